@@ -1,23 +1,32 @@
 # Complete this class for all parts of the project
 
+from collections import OrderedDict
+
 import numpy as np
 
 # import matplotlib.pyplot as plt
 # only important for record_metrics
 
 from pacman_module.game import Agent
+from pacman_module.ghostAgents import AfraidGhost, ConfusedGhost, \
+    ScaredGhost, POLICY_MOVES, fleeingPolicyTable
 from pacman_module import util
+from scipy import sparse
+from scipy.special import logsumexp
 from scipy.stats import binom
 
 
 class BeliefStateAgent(Agent):
-    def __init__(self, args):
+    def __init__(self, args, rng=None):
         """
         Arguments:
         ----------
         - `args`: Namespace of arguments from command-line prompt.
+        - `rng`: numpy Generator of the particle filter, the global
+          numpy random state if None.
         """
         self.args = args
+        self.rng = np.random if rng is None else rng
         """
             Variables to use in 'update_belief_state' method.
             Initialization occurs in 'get_action' method.
@@ -28,46 +37,206 @@ class BeliefStateAgent(Agent):
         # Current list of belief states over ghost positions
         self.beliefGhostStates = None
 
+        # Contiguous [Z, width, height] tensor of belief states,
+        # 'beliefGhostStates' holds views into it
+        self.belief_tensor = None
+
+        # [Z, N] belief states over the N free cells
+        self.compact_belief = None
+
         # Grid of walls (assigned with 'state.getWalls()' method)
         self.walls = None
 
         # Hyper-parameters
         self.ghost_type = self.args.ghostagent
+        # Weight of the moves that do not bring the ghosts closer to
+        # pacman, see 'ghostAgents.FleeingGhost'
+        weights = {"confused": ConfusedGhost.weight,
+                   "afraid": AfraidGhost.weight,
+                   "scared": ScaredGhost.weight}
+        self.ghost_weight = weights.get(
+            self.ghost_type, getattr(self.args, 'ghostweight', 1))
         self.sensor_variance = self.args.sensorvariance
 
         self.p = 0.5
         self.n = int(self.sensor_variance/(self.p*(1-self.p)))
 
-    def _get_sensor_model(self, pacman_position, evidence):
+        # Sensor likelihood indexed by the integer offset
+        # distance - evidence + n*p, which follows Binomial(n, p)
+        self.sensor_pmf = binom.pmf(np.arange(self.n + 1), self.n, self.p)
+        self.sensor_logpmf = binom.logpmf(np.arange(self.n + 1),
+                                          self.n, self.p)
+
+        # Opt-in log-domain filtering, robust to underflow in long games
+        self.log_belief = getattr(self.args, 'logbelief', False)
+        self.log_compact_belief = None
+
+        # Filtering backend: exact Bayes filter or particle filter
+        self.backend = getattr(self.args, 'bsbackend', 'exact')
+        self.n_particles = getattr(self.args, 'nparticles', 1000)
+
+        # [Z, n_particles] array of free cell indices
+        self.particles = None
+
+        # Compact indexing of the free cells (see '_get_free_cells')
+        self.cells = None
+        self.cell_positions = None
+        self.cell_index = None
+
+        # Manhattan distance field from the last pacman position,
+        # sliced out of a field of offsets (see '_get_distance_field')
+        self.distance_position = None
+        self.distance_field = None
+        self.offset_field = None
+        self.cell_offsets = None
+
+        # LRU cache of transition models,
+        # keyed by (pacman_position, ghost_type)
+        self.transition_cache = OrderedDict()
+        self.transition_cache_size = getattr(
+            self.args, 'transitioncache', 256)
+        self.precompute_transitions = getattr(
+            self.args, 'precomputetransitions', False)
+
+    def _get_free_cells(self):
+        """
+        Builds, once, the compact indexing of the free cells of the maze
+        on which all belief computations run.
+
+        Return:
+        -------
+        - The flat indices x*height + y of the N free cells,
+          as a numpy array of size [N].
+        - The (x, y) coordinates of the free cells,
+          as a numpy array of size [N, 2].
+        - The index in 0..N-1 of every cell, -1 for walls,
+          as a 2D numpy array of size [width, height].
+        """
+        if self.cells is None:
+            free = np.logical_not(np.asarray(self.walls))
+            self.cells = np.flatnonzero(free)
+            self.cell_positions = np.argwhere(free)
+            self.cell_index = np.full(free.shape, -1)
+            self.cell_index[free] = np.arange(len(self.cells))
+
+        return self.cells, self.cell_positions, self.cell_index
+
+    def _to_grid(self, compact):
+        """
+        Arguments:
+        ----------
+        - `compact`: Z vectors of size N over the free cells,
+          as a numpy array of size [Z, N].
+
+        Return:
+        -------
+        The same values as a numpy array of size [Z, width, height],
+        filled with zeros on walls.
+        """
+        cells = self._get_free_cells()[0]
+        grid = np.zeros((len(compact), self.walls.width * self.walls.height))
+        grid[:, cells] = compact
+
+        return grid.reshape((len(compact), self.walls.width,
+                             self.walls.height))
+
+    def _get_sensor_model(self, pacman_position, evidence, log=False):
         """
         Arguments:
         ----------
         - `pacman_position`: 2D coordinates position
           of pacman at state x_{t}
           where 't' is the current time step
+        - `evidence`: a noisy distance, or a list of Z noisy distances
+          between pacman and ghosts at state x_{t}
+        - `log`: whether to return log-likelihoods instead
 
         Return:
         -------
-        The sensor model represented as a 2D numpy array of
-        size [width, height].
-        The element at position (w, h) is the probability
-        P(E_t=evidence | X_t=(w, h))
+        The sensor model over the N free cells represented as a numpy
+        array of size [N], or of size [Z, N] for a list of evidences.
+        The element at position i is the probability
+        P(E_t=evidence | X_t=c_i), or its logarithm,
+        where c_i is the i-th free cell (see `_get_free_cells`).
         """
-        walls = self.walls
-        w = walls.width
-        h = walls.height
+        evidence = np.asarray(evidence, dtype=float)[..., None]
+        offset = self._get_distance_field(pacman_position) - evidence + \
+            self.n*self.p
 
-        sensor = np.zeros((w, h))
+        return self._get_sensor_likelihood(offset, log)
 
-        for i in range(w):
-            for j in range(h):
-                # compute pacman distance from (i,j) and compute with binomial
-                distPacmanIJ = util.manhattanDistance(pacman_position, (i, j))
-                sensor[i][j] = binom.pmf(distPacmanIJ - evidence +
-                                         self.n*self.p, self.n, self.p)
+    def _get_particle_sensor_model(self, pacman_position, evidence,
+                                   particles):
+        """
+        Counterpart of `_get_sensor_model` restricted to the cells of
+        `particles`, an array of free cell indices, so that its cost
+        does not depend on the size of the maze.
+
+        Return:
+        -------
+        The probabilities P(E_t=evidence | X_t=c_i) for the cells c_i
+        of the particles, as a numpy array of the shape of `particles`.
+        """
+        positions = self._get_free_cells()[1][particles]
+        distance = np.abs(positions[..., 0] - pacman_position[0]) + \
+            np.abs(positions[..., 1] - pacman_position[1])
+
+        return self._get_sensor_likelihood(
+            distance - float(evidence) + self.n*self.p)
+
+    def _get_sensor_likelihood(self, offset, log=False):
+        """
+        Returns the binomial probabilities, or their logarithms, of the
+        offsets distance - evidence + n*p, given as a numpy array.
+        """
+        # the binomial mass is only non-zero on integers in [0, n]
+        valid = (offset == np.floor(offset)) & \
+            (offset >= 0) & (offset <= self.n)
+
+        if log:
+            sensor = np.full(offset.shape, -np.inf)
+            sensor[valid] = self.sensor_logpmf[offset[valid].astype(int)]
+        else:
+            sensor = np.zeros(offset.shape)
+            sensor[valid] = self.sensor_pmf[offset[valid].astype(int)]
 
         return sensor
 
+    def _get_distance_field(self, pacman_position):
+        """
+        Arguments:
+        ----------
+        - `pacman_position`: 2D coordinates position
+          of pacman at state x_{t}
+          where 't' is the current time step
+
+        Return:
+        -------
+        The Manhattan distances from pacman to the N free cells,
+        represented as a numpy array of size [N].
+        The distances are read from one [2*width-1, 2*height-1] field
+        of offsets built once, shifted by pacman's position, and are
+        cached until pacman moves.
+        """
+        if pacman_position != self.distance_position:
+            w = self.walls.width
+            h = self.walls.height
+
+            if self.offset_field is None:
+                positions = self._get_free_cells()[1]
+                self.offset_field = np.ravel(
+                    np.abs(np.arange(2*w - 1) - (w - 1))[:, None] +
+                    np.abs(np.arange(2*h - 1) - (h - 1))[None, :])
+                self.cell_offsets = positions[:, 0] * (2*h - 1) + \
+                    positions[:, 1]
+
+            x, y = int(pacman_position[0]), int(pacman_position[1])
+            shift = (w - 1 - x) * (2*h - 1) + (h - 1 - y)
+            self.distance_field = self.offset_field[self.cell_offsets + shift]
+            self.distance_position = pacman_position
+
+        return self.distance_field
+
     def _get_transition_model(self, pacman_position):
         """
         Arguments:
@@ -78,57 +247,118 @@ class BeliefStateAgent(Agent):
 
         Return:
         -------
-        The transition model represented as a 4D numpy array of
-        size [width, height, width, height].
-        The element at position (w1, h1, w2, h2) is the probability
-        P(X_t+1=(w1, h1) | X_t=(w2, h2))
+        The transition model of `_build_transition_model`, served from
+        a bounded LRU cache since it only depends on the walls, the ghost
+        type and pacman's position.
+        When transitions are precomputed, the models for every free
+        pacman position are built on the first call.
         """
-        walls = self.walls
+        return self._get_cached_transition(pacman_position)[0]
 
-        w = walls.width
-        h = walls.height
-        ghostType = self.ghost_type
+    def _get_cached_transition(self, pacman_position):
+        """
+        Return:
+        -------
+        The entry of the transition cache for `pacman_position`: the
+        transition model, see `_get_transition_model`, and with the
+        particle backend the tables that sample successors from it,
+        see `_build_particle_moves`, None otherwise.
+        """
+        cache = self.transition_cache
 
-        neighbors = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+        if self.precompute_transitions and not cache:
+            positions = [tuple(position) for position
+                         in self._get_free_cells()[1].tolist()]
+            self.transition_cache_size = max(self.transition_cache_size,
+                                             len(positions))
+            for position in positions:
+                cache[(position, self.ghost_type)] = \
+                    self._build_transition_entry(position)
 
-        transition = np.zeros((w, h, w, h))
+        key = (tuple(pacman_position), self.ghost_type)
 
-        # setting mul to a value relative to the ghost's behaviour
-        if ghostType == "confused":
-            mul = 1
-        elif ghostType == "afraid":
-            mul = 2
-        else:
-            mul = 8
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
 
-        for i in range(1, w-1):
-            for j in range(1, h-1):
+        entry = self._build_transition_entry(pacman_position)
 
-                if not walls[i][j]:
-                    dist = util.manhattanDistance(pacman_position, (i, j))
-                    norm = 0
+        if self.transition_cache_size > 0:
+            cache[key] = entry
+            if len(cache) > self.transition_cache_size:
+                cache.popitem(last=False)
 
-                    for (k, l) in neighbors:
-                        # if neighbor is a wall, probability = 0
-                        if walls[i + k][j + l]:
-                            transition[i + k][j + l][i][j] = 0
+        return entry
 
-                        # ghost gets closer
-                        elif dist < util.manhattanDistance(pacman_position,
-                                                           (i + k, j + l)):
-                            norm += mul
-                            transition[i + k][j + l][i][j] = mul
+    def _build_transition_entry(self, pacman_position):
+        transition = self._build_transition_model(pacman_position)
+        moves = None
+        if self.backend == "particle":
+            moves = self._build_particle_moves(transition)
 
-                        # ghost drives away from pacman
-                        else:
-                            norm += 1
-                            transition[i + k][j + l][i][j] = 1
+        return transition, moves
 
-                    for (k, l) in neighbors:
-                        if norm != 0:
-                            transition[i + k][j + l][i][j] /= norm
+    def _build_particle_moves(self, transition):
+        """
+        Arguments:
+        ----------
+        - `transition`: a transition model, see `_get_transition_model`.
+
+        Return:
+        -------
+        The tables that sample the successor of a cell by inverting the
+        cumulative mass of its column of `transition`:
+        - the successor cell of each entry, of size [nnz],
+        - the cumulative mass of the entries, preceded by 0,
+          of size [nnz + 1],
+        - the entries of cell i, which are in indptr[i]:indptr[i+1],
+          of size [N + 1].
+        """
+        moves = transition.T.tocsr()
+        cumulative = np.concatenate(([0.], np.cumsum(moves.data)))
 
-        return transition
+        return moves.indices, cumulative, moves.indptr
+
+    def _build_transition_model(self, pacman_position):
+        """
+        Arguments:
+        ----------
+        - `pacman_position`: 2D coordinates position
+          of pacman at state x_{t}
+          where 't' is the current time step
+
+        Return:
+        -------
+        The transition model represented as a sparse CSR matrix of
+        size [N, N] over the N free cells (see `_get_free_cells`).
+        The element at position (i1, i2) is the probability
+        P(X_t+1=c_i1 | X_t=c_i2), where c_i is the i-th free cell.
+        The matrix holds at most four non-zero elements per column,
+        read from the policy table of the ghosts, shared with the
+        ghost agents (see `ghostAgents.fleeingPolicyTable`).
+        """
+        cells, positions, index = self._get_free_cells()
+        table = fleeingPolicyTable(self.walls, tuple(pacman_position),
+                                   self.ghost_weight)
+
+        rows = []
+        cols = []
+        data = []
+
+        for k, (_, (dx, dy)) in enumerate(POLICY_MOVES):
+            proba = table[positions[:, 0], positions[:, 1], k]
+            moves = np.flatnonzero(proba)
+            rows.append(index[positions[moves, 0] + dx,
+                              positions[moves, 1] + dy])
+            cols.append(moves)
+            data.append(proba[moves])
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        data = np.concatenate(data)
+
+        return sparse.csr_matrix((data, (rows, cols)),
+                                 shape=(len(cells), len(cells)))
 
     def _get_updated_belief(self, belief, evidences, pacman_position,
                             ghosts_eaten):
@@ -162,42 +392,218 @@ class BeliefStateAgent(Agent):
         N.B. : [0,0] is the bottom left corner of the maze.
                Matrices filled with zeros must be returned for eaten ghosts.
         """
-        walls = self.walls
-        w = walls.width
-        h = walls.height
+        transition, moves = self._get_cached_transition(pacman_position)
+
+        if self.backend == "particle":
+            if moves is None:
+                moves = self._build_particle_moves(transition)
+            return self._get_updated_particle_belief(moves, evidences,
+                                                     pacman_position,
+                                                     ghosts_eaten)
 
-        transition = self._get_transition_model(pacman_position)
-        belief = []
+        if self.log_belief:
+            return self._get_updated_log_belief(transition, evidences,
+                                                pacman_position,
+                                                ghosts_eaten)
 
         nGhosts = len(ghosts_eaten)
-        ghostsBelief = self.beliefGhostStates
 
-        for ghost in range(nGhosts):
-            sumMatrix = np.zeros((w, h))
-            sensor = self._get_sensor_model(pacman_position, evidences[ghost])
+        if self.compact_belief is None:
+            self.compact_belief = self._get_prior(nGhosts)
 
-            for i in range(1, w-1):
-                for j in range(1, h-1):
-                    # we have to skip to eaten ghosts
-                    if not ghosts_eaten[ghost]:
-                        for k in range(w):
-                            for l in range(h):
-                                # compute each element
-                                sumElem = ghostsBelief[ghost][i][j] * \
-                                           transition[k][l][i][j]
-                                sumMatrix[k][l] += sumElem
+        ghostsBelief = self.compact_belief
+        alive = np.logical_not(ghosts_eaten)
 
-            # thanks to the use of numpy, the next steps are easy
-            matrixProduct = np.multiply(sensor, sumMatrix)
+        # prediction step for all the ghosts not eaten at once,
+        # eaten ghosts keep a belief filled with zeros
+        prediction = np.zeros(ghostsBelief.shape)
+        if alive.any():
+            prediction[alive] = transition.dot(ghostsBelief[alive].T).T
 
-            norm = sum(sum(matrixProduct))
+        sensor = self._get_sensor_model(pacman_position, evidences)
+        matrixProduct = sensor * prediction
 
-            if norm:
-                matrixProduct /= norm
+        norm = matrixProduct.sum(axis=1, keepdims=True)
+        np.divide(matrixProduct, norm, out=matrixProduct, where=norm != 0)
 
-            belief.append((matrixProduct))
+        # a new tensor each step, previous beliefs may still be referenced
+        self.compact_belief = matrixProduct
+        self.belief_tensor = self._to_grid(matrixProduct)
 
-        return belief
+        return list(self.belief_tensor)
+
+    def _get_prior(self, nGhosts):
+        """
+        Arguments:
+        ----------
+        - `nGhosts`: the number Z of ghosts.
+
+        Return:
+        -------
+        The initial belief states of 'beliefGhostStates' restricted to
+        the N free cells, as a numpy array of size [Z, N].
+        """
+        cells = self._get_free_cells()[0]
+        prior = np.reshape(self.beliefGhostStates,
+                           (nGhosts, self.walls.width * self.walls.height))
+
+        return np.array(prior[:, cells], dtype=float)
+
+    def _get_updated_log_belief(self, transition, evidences,
+                                pacman_position, ghosts_eaten):
+        """
+        Log-domain counterpart of `_get_updated_belief`: the prediction of
+        each cell is a log-sum-exp over the entries of its row of the
+        transition model, and the evidence is added as log-likelihoods,
+        so log-beliefs never underflow to -inf.
+        When the evidence is inconsistent with the whole support of the
+        prediction, the evidence is dropped for that step; when the
+        prediction itself is empty, the belief is reset to uniform over
+        free cells.
+
+        Arguments:
+        ----------
+        - `transition`: The transition model at state x_{t},
+          see `_get_transition_model`.
+        - `evidences`: list of distances between
+          pacman and ghosts at state x_{t}
+          where 't' is the current time step
+        - `pacman_position`: 2D coordinates position
+          of pacman at state x_{t}
+          where 't' is the current time step
+        - `ghosts_eaten`: list of booleans indicating
+          whether ghosts have been eaten or not
+
+        Return:
+        -------
+        - A list of Z belief states at state x_{t}
+          as N*M numpy mass probability matrices
+          where N and M are respectively width and height
+          of the maze layout and Z is the number of ghosts.
+        """
+        nGhosts = len(ghosts_eaten)
+
+        if self.log_compact_belief is None:
+            with np.errstate(divide='ignore'):
+                self.log_compact_belief = np.log(self._get_prior(nGhosts))
+
+        logBelief = self.log_compact_belief
+        alive = np.logical_not(ghosts_eaten)
+
+        logPrediction = np.full(logBelief.shape, -np.inf)
+        logSensor = self._get_sensor_model(pacman_position, evidences,
+                                           log=True)
+
+        # log-sum-exp of log(T[i, j]) + logBelief[j] over the entries j
+        # of each row i, reduced over the rows that have entries
+        transition = transition.tocsr()
+        start, end = transition.indptr[:-1], transition.indptr[1:]
+        rows = start < end
+        with np.errstate(divide='ignore'):
+            logTransition = np.log(transition.data)
+        if rows.any():
+            terms = logTransition + logBelief[:, transition.indices]
+            logPrediction[:, rows] = np.logaddexp.reduceat(
+                terms, start[rows], axis=1)
+
+        # nothing left to predict from, start over
+        empty = alive & np.isneginf(logPrediction.max(axis=1))
+        logPrediction[empty] = 0.
+        logPrediction[np.logical_not(alive)] = -np.inf
+
+        logPosterior = logPrediction + logSensor
+
+        # evidence inconsistent with every predicted position
+        inconsistent = alive & np.isneginf(logPosterior.max(axis=1))
+        logPosterior[inconsistent] = logPrediction[inconsistent]
+
+        logNorm = logsumexp(logPosterior[alive], axis=1, keepdims=True)
+        logPosterior[alive] -= logNorm
+
+        self.log_compact_belief = logPosterior
+        self.compact_belief = np.exp(logPosterior)
+        self.belief_tensor = self._to_grid(self.compact_belief)
+
+        return list(self.belief_tensor)
+
+    def _get_updated_particle_belief(self, moves, evidences,
+                                     pacman_position, ghosts_eaten):
+        """
+        Particle filter counterpart of `_get_updated_belief`: particles
+        are moved through the transition model, weighted by the sensor
+        model, then resampled with systematic resampling.
+        When no particle is consistent with the evidence, the particles
+        of that ghost are spread again uniformly over free cells.
+        Past the first step, the work only depends on the number of
+        particles, except for filling the returned grids.
+
+        Arguments:
+        ----------
+        - `moves`: The sampling tables of the transition model at
+          state x_{t}, see `_build_particle_moves`.
+        - `evidences`: list of distances between
+          pacman and ghosts at state x_{t}
+          where 't' is the current time step
+        - `pacman_position`: 2D coordinates position
+          of pacman at state x_{t}
+          where 't' is the current time step
+        - `ghosts_eaten`: list of booleans indicating
+          whether ghosts have been eaten or not
+
+        Return:
+        -------
+        - A list of Z belief states at state x_{t}
+          as N*M numpy mass probability matrices
+          where N and M are respectively width and height
+          of the maze layout and Z is the number of ghosts.
+        """
+        nGhosts = len(ghosts_eaten)
+        nParticles = self.n_particles
+        cells = self._get_free_cells()[0]
+        nCells = len(cells)
+
+        if self.particles is None:
+            self.particles = np.array([
+                util.nSample(p, None, nParticles, self.rng)
+                for p in self._get_prior(nGhosts)])
+
+        successors, cumulative, indptr = moves
+        grid = np.zeros((nGhosts, self.walls.width * self.walls.height))
+
+        for ghost in np.flatnonzero(np.logical_not(ghosts_eaten)):
+            particles = self.particles[ghost]
+            start = indptr[particles]
+            end = indptr[particles + 1]
+
+            # prediction
+            before = cumulative[start]
+            target = before + \
+                self.rng.random(nParticles) * (cumulative[end] - before)
+            index = np.searchsorted(cumulative, target, side='right') - 1
+            index = np.clip(index, start, end - 1)
+            particles = np.where(end > start, successors[index], particles)
+
+            # weighting
+            weights = self._get_particle_sensor_model(
+                pacman_position, evidences[ghost], particles)
+            total = weights.sum()
+            if total == 0:
+                particles = self.rng.choice(nCells, size=nParticles)
+                weights = np.ones(nParticles)
+                total = nParticles
+
+            occupied, inverse = np.unique(particles, return_inverse=True)
+            grid[ghost, cells[occupied]] = np.bincount(
+                inverse, weights=weights) / total
+
+            # systematic resampling
+            self.particles[ghost] = particles[util.nSample(
+                weights, None, nParticles, self.rng, systematic=True)]
+
+        self.belief_tensor = grid.reshape((nGhosts, self.walls.width,
+                                           self.walls.height))
+
+        return list(self.belief_tensor)
 
     def update_belief_state(self, evidences, pacman_position, ghosts_eaten):
         """
@@ -278,43 +684,6 @@ class BeliefStateAgent(Agent):
 
         N.B. : [0,0] is the bottom left corner of the maze
         """
-        """
-        walls = self.walls
-
-        w = walls.width
-        h = walls.height
-
-        for ghostID in range(1, len(belief_states) + 1):
-            ghostPos = state.getGhostPosition(ghostID)
-
-            returnBelief = 0.0
-            returnQuality = 0
-
-            if ghostPos[0] >= 0:
-                maxBeliefPos = (0, 0)
-                maxBelief = 0.0
-
-                for i in range(w):
-                    for j in range(h):
-                        belief = belief_states[ghostID - 1][i][j]
-
-                        if belief > maxBelief:
-                            maxBeliefPos = (i, j)
-                            maxBelief = belief
-
-                returnBelief = maxBelief
-                returnQuality = util.manhattanDistance(ghostPos, maxBeliefPos)
-
-            file = open("values.txt", "w")
-            file.write("%f \n" % returnBelief)
-            file.write("%d" % returnQuality)
-            file.close()
-
-        if self.nbIt == 100:
-            exit()
-
-        self.nbIt += 1
-        """
         pass
 
     def get_action(self, state):
@@ -0,0 +1,388 @@
+import json
+import random
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+
+import numpy as np
+
+from bayesfilter import BeliefStateAgent
+from pacmanagent import PacmanAgent
+from pacman_module.layout import Layout
+from pacman_module.pacman import GameState
+from pacman_module.util import manhattanDistance
+from run import check_args
+
+
+class SensorNoise:
+    """
+    Buffer of the noise of the sensor, Binomial(n, p) - n*p as in
+    `bayesfilter.BeliefStateAgent._get_evidence`, drawn by blocks of
+    `size` values from the numpy Generator `rng`, or from the global
+    numpy random state like `binom.rvs`, to simulate the sensor
+    without a game.
+
+    A block holds the same values as successive `binom.rvs` calls, so
+    seeded observations are unchanged:
+
+    >>> from scipy.stats import binom
+    >>> np.random.seed(0)
+    >>> expected = [binom.rvs(4, 0.5) - 2. for _ in range(10)]
+    >>> np.random.seed(0)
+    >>> noise = SensorNoise(4, 0.5, size=4)
+    >>> [noise.draw() for _ in range(10)] == expected
+    True
+    >>> np.random.seed(0)
+    >>> SensorNoise(4, 0.5, size=4).draws(10).tolist() == expected
+    True
+    """
+
+    def __init__(self, n, p, rng=None, size=4096):
+        self.n = n
+        self.p = p
+        self.rng = np.random if rng is None else rng
+        self.size = size
+        self.buffer = np.empty(0)
+        self.position = 0
+
+    def _refill(self):
+        self.buffer = self.rng.binomial(self.n, self.p, size=self.size) - \
+            self.n*self.p
+        self.position = 0
+
+    def draw(self):
+        """
+        Returns the next noise value.
+        """
+        if self.position == len(self.buffer):
+            self._refill()
+        self.position += 1
+        return float(self.buffer[self.position - 1])
+
+    def draws(self, count):
+        """
+        Returns the next `count` noise values, as a numpy array.
+        """
+        chunks = [np.empty(0)]
+        while count > 0:
+            if self.position == len(self.buffer):
+                self._refill()
+            chunk = self.buffer[self.position:self.position + count]
+            self.position += len(chunk)
+            count -= len(chunk)
+            chunks.append(chunk)
+        return np.concatenate(chunks)
+
+
+def synthetic_layout(width, height, density, rng, nghosts=0):
+    """
+    Builds a random maze enclosed by walls.
+
+    Arguments:
+    ----------
+    - `width`, `height`: size of the maze, borders included.
+    - `density`: fraction of the inner cells that are walls.
+    - `rng`: a `random.Random` instance.
+    - `nghosts`: number of ghosts to place on free cells.
+
+    Return:
+    -------
+    - A `layout.Layout` with pacman and the ghosts on free cells.
+    """
+    rows = []
+    for y in range(height):
+        row = []
+        for x in range(width):
+            border = x in (0, width - 1) or y in (0, height - 1)
+            row.append('%' if border or rng.random() < density else ' ')
+        rows.append(row)
+
+    free = [(x, y) for y in range(height) for x in range(width)
+            if rows[y][x] == ' ']
+    for x, y, c in zip(*zip(*rng.sample(free, nghosts + 1)),
+                       'P' + 'G' * nghosts):
+        rows[y][x] = c
+
+    return Layout([''.join(row) for row in rows])
+
+
+def percentiles(samples):
+    """
+    Summarizes latencies, given in seconds, in milliseconds.
+    """
+    samples = np.asarray(samples) * 1000.
+    return {"p50": float(np.percentile(samples, 50)),
+            "p90": float(np.percentile(samples, 90)),
+            "p99": float(np.percentile(samples, 99)),
+            "max": float(samples.max())}
+
+
+def run_filter(layout, nghosts, steps, args, seed, timings=None):
+    """
+    Runs the Bayes filter on a layout while pacman wanders randomly
+    and the ghosts sit on random free cells.
+
+    Arguments:
+    ----------
+    - `timings`: if given, a dictionary to which the latency of each
+      timed method is appended, keyed by method name.
+    """
+    rng = random.Random(seed)
+    np.random.seed(seed)
+    walls = layout.walls
+    free = walls.asList(False)
+
+    agent = BeliefStateAgent(args)
+    agent.walls = walls
+    uniform = np.logical_not(np.asarray(walls)).astype(float)
+    agent.beliefGhostStates = np.repeat(
+        (uniform / uniform.sum())[None], nghosts, axis=0)
+
+    noise = SensorNoise(agent.n, agent.p)
+
+    pacman = layout.agentPositions[0][1]
+    ghosts = [rng.choice(free) for _ in range(nghosts)]
+    eaten = [False] * nghosts
+
+    calls = [
+        ("_get_sensor_model",
+         lambda: agent._get_sensor_model(pacman, evidences)),
+        ("_build_transition_model",
+         lambda: agent._build_transition_model(pacman)),
+        ("_get_transition_model",
+         lambda: agent._get_transition_model(pacman)),
+        ("_get_updated_belief",
+         lambda: agent.update_belief_state(evidences, pacman, eaten))]
+
+    for _ in range(steps):
+        moves = [p for p in free if manhattanDistance(p, pacman) == 1]
+        pacman = rng.choice(moves) if moves else pacman
+        evidences = [manhattanDistance(pacman, g) + noise.draw()
+                     for g in ghosts]
+
+        for name, call in calls:
+            t = time.perf_counter()
+            call()
+            if timings is not None:
+                timings.setdefault(name, []).append(time.perf_counter() - t)
+
+
+def bench_filter(layout, nghosts, steps, args, seed):
+    """
+    Times the Bayes filter hot path on a layout.
+
+    Return:
+    -------
+    - A dictionary of per-step latency percentiles of
+      `_get_sensor_model`, `_build_transition_model`,
+      `_get_transition_model` and `_get_updated_belief`,
+      and the peak memory of a second, traced run in bytes.
+    """
+    timings = {}
+    run_filter(layout, nghosts, steps, args, seed, timings)
+
+    # tracing slows allocations down, so memory is measured separately
+    tracemalloc.start()
+    run_filter(layout, nghosts, steps, args, seed)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {name: percentiles(samples)
+              for name, samples in timings.items()}
+    result["peak_memory"] = peak
+    return result
+
+
+def bench_successors(layout, nghosts, rounds, seed):
+    """
+    Times `GameState.generateSuccessor` for every legal move of pacman
+    and of each ghost, in belief-tracking and in classic games.
+
+    Return:
+    -------
+    - A dictionary of per-call latency percentiles for each game mode,
+      and the number of timed calls.
+    """
+    rng = random.Random(seed)
+    result = {}
+
+    for mode, beliefStateAgent in (("belief", object()), ("classic", None)):
+        state = GameState()
+        state.initialize(layout, nghosts, edibleGhosts=True,
+                         beliefStateAgent=beliefStateAgent)
+        agents = [index for index, agentState
+                  in enumerate(state.data.agentStates)
+                  if agentState.agtType >= 0]
+        timings = []
+
+        for _ in range(rounds):
+            for agent in agents:
+                if state.isWin() or state.isLose():
+                    break
+                legal = state.getLegalActions(agent)
+                for action in legal:
+                    t = time.perf_counter()
+                    state.generateSuccessor(agent, action)
+                    timings.append(time.perf_counter() - t)
+                state = state.generateSuccessor(agent, rng.choice(legal))
+
+        result[mode] = percentiles(timings)
+        result[mode]["calls"] = len(timings)
+
+    return result
+
+
+def bench_astar(layout, nghosts, repeats, seed):
+    """
+    Measures `PacmanAgent.aStar` searches from pacman to random free
+    cells in a belief-tracking game.
+
+    Return:
+    -------
+    - A dictionary of search latency percentiles, and the mean peak
+      memory of a search in bytes, traced in separate runs.
+    """
+    rng = random.Random(seed)
+    state = GameState()
+    state.initialize(layout, nghosts, edibleGhosts=True,
+                     beliefStateAgent=object())
+    belief = [np.asarray(b) for b in state.getGhostBeliefStates()]
+    targets = [rng.choice(layout.walls.asList(False))
+               for _ in range(repeats)]
+    agent = PacmanAgent(Namespace())
+
+    timings = []
+    for target in targets:
+        t = time.perf_counter()
+        agent.aStar(state, target, belief, 1)
+        timings.append(time.perf_counter() - t)
+
+    peaks = []
+    for target in targets:
+        tracemalloc.start()
+        agent.aStar(state, target, belief, 1)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    result = {"astar": percentiles(timings)}
+    result["peak_memory"] = float(np.mean(peaks))
+    return result
+
+
+def parse_size(x):
+    width, height = x.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == '__main__':
+    usage = """
+    USAGE:      python benchmark.py <options>
+    EXAMPLES:   (1) python benchmark.py --sizes 20x11,50x50 --nghosts 1,4
+                    - times the Bayes filter on small random mazes
+                      and prints the report as JSON
+                (2) python benchmark.py --suite successors --sizes 20x11
+                    - times successor state generation
+                (3) python benchmark.py --suite astar --sizes 20x11
+                    - times the A* search of `pacmanagent.py` and
+                      measures its memory
+    """
+
+    parser = ArgumentParser(usage)
+    parser.add_argument(
+        '--suite',
+        help='What to benchmark.',
+        choices=["filter", "successors", "astar"], default="filter")
+    parser.add_argument(
+        '--seed',
+        help='Seed for random number generator',
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--sizes',
+        help='Comma-separated maze sizes, as WIDTHxHEIGHT.',
+        default="20x11,50x50,100x100,200x200")
+    parser.add_argument(
+        '--densities',
+        help='Comma-separated fractions of inner cells that are walls.',
+        default="0.0,0.1,0.3")
+    parser.add_argument(
+        '--nghosts',
+        help='Comma-separated numbers of ghosts.',
+        default="1,2,4,8")
+    parser.add_argument(
+        '--steps',
+        help='Number of filter steps, of rounds of moves for the '
+             'successors suite, or of searches for the astar suite, '
+             'timed per configuration.',
+        type=int, default=20)
+    parser.add_argument(
+        '--ghostagent',
+        help='Ghost model used by the filter.',
+        choices=["confused", "afraid", "scared"], default="scared")
+    parser.add_argument(
+        '--sensorvariance',
+        help='The variance of the sensor estimates.',
+        default=1.0,
+        type=float)
+    parser.add_argument(
+        '--bsbackend',
+        help='Filtering backend of the belief state agent.',
+        choices=["exact", "particle"], default="exact")
+    parser.add_argument(
+        '--nparticles',
+        help='Number of particles per ghost of the particle backend.',
+        type=int, default=1000)
+    parser.add_argument(
+        '--logbelief',
+        help='Run the Bayes filter in the log domain '
+             '(exact backend only).',
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        '--output',
+        help='File to write the JSON report to, instead of stdout.',
+        default=None)
+
+    options = parser.parse_args()
+    try:
+        check_args(options)
+    except ValueError as e:
+        parser.error(str(e))
+    args = Namespace(ghostagent=options.ghostagent,
+                     sensorvariance=options.sensorvariance,
+                     bsbackend=options.bsbackend,
+                     nparticles=options.nparticles,
+                     logbelief=options.logbelief)
+
+    report = []
+    for size in options.sizes.split(','):
+        width, height = parse_size(size)
+        for density in options.densities.split(','):
+            rng = random.Random(options.seed)
+            layout = synthetic_layout(
+                width, height, float(density), rng,
+                max(int(n) for n in options.nghosts.split(',')))
+            for nghosts in options.nghosts.split(','):
+                if options.suite == "successors":
+                    result = bench_successors(layout, int(nghosts),
+                                              options.steps, options.seed)
+                elif options.suite == "astar":
+                    result = bench_astar(layout, int(nghosts),
+                                         options.steps, options.seed)
+                else:
+                    result = bench_filter(layout, int(nghosts),
+                                          options.steps, args, options.seed)
+                    result["backend"] = options.bsbackend
+                result.update({"suite": options.suite,
+                               "size": [width, height],
+                               "density": float(density),
+                               "free_cells": len(layout.walls.asList(False)),
+                               "nghosts": int(nghosts),
+                               "steps": options.steps})
+                report.append(result)
+
+    if options.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,150 @@
+import multiprocessing
+
+from pacman_module import layout as layouts
+from pacman_module.metrics import beliefMetrics
+from pacman_module.pacman import ClassicGameRules
+from run import build_parser, check_args, ghosts, load_agent_from_file, \
+    seed_game, set_agent_rng
+
+# Layouts are immutable, so each process parses each of them once
+_layout_cache = {}
+
+
+def make_args(**options):
+    """
+    Returns the arguments of `run.py`, with their default values
+    overridden by `options` (e.g. `ghostagent="scared"`).
+    """
+    args = build_parser().parse_args([])
+    for name, value in options.items():
+        if not hasattr(args, name):
+            raise ValueError("Unknown option %r" % name)
+        setattr(args, name, value)
+    check_args(args)
+    return args
+
+
+def get_layout(name):
+    if name not in _layout_cache:
+        _layout_cache[name] = layouts.getLayout(name)
+    return _layout_cache[name]
+
+
+def belief_metrics(state):
+    """
+    Measures the belief states of a game state against the true
+    positions of the ghosts.
+
+    Return:
+    -------
+    - The maximum probability of the belief state of each ghost.
+    - The manhattan distance between each ghost and the most likely
+      cell of its belief state.
+    Both are 0 for ghosts that have been eaten.
+    """
+    max_belief, belief_error, _ = beliefMetrics(
+        state.getGhostBeliefStates(), state.getGhostPositions())
+    eaten = belief_error < 0
+    max_belief[eaten] = 0.
+    belief_error[eaten] = 0
+
+    return max_belief.tolist(), belief_error.tolist()
+
+
+def run_experiment(layout, ghost, seed, nghosts=1,
+                   agentfile="stopagent.py", bsagentfile="bayesfilter.py",
+                   maxMoves=100, **options):
+    """
+    Plays one headless game in this process.
+
+    Arguments:
+    ----------
+    - `layout`: maze layout name (from layout folder).
+    - `ghost`: ghost agent, one of the keys of `run.ghosts`.
+    - `seed`: seed of the random streams of the game, see
+      `run.seed_game`, so that a game does not depend on the process
+      that plays it nor on the games played before it.
+    - `agentfile`, `bsagentfile`: files of the `PacmanAgent` and
+      `BeliefStateAgent` classes, as in `run.py`.
+    - `maxMoves`: number of rounds of moves after which the game is
+      stopped, None to play until the end.
+    - `options`: other options of `run.py` given to the agents.
+
+    Return:
+    -------
+    - A dictionary with the game parameters, its score, number of
+      rounds, outcome, agent computation times and, when a belief
+      state agent is given, the `belief_metrics` of its final state.
+    """
+    args = make_args(ghostagent=ghost, layout=layout, nghosts=nghosts,
+                     agentfile=agentfile, bsagentfile=bsagentfile,
+                     seed=seed, **options)
+    layout_rng, bsagent_rng, ghost_rngs = seed_game(seed, nghosts)
+
+    agent = load_agent_from_file(agentfile, "PacmanAgent")(args)
+    gagts = [ghosts[ghost](i + 1, args, rng=ghost_rngs[i])
+             for i in range(nghosts)]
+    bsagt = None
+    startingIndex = 0
+    if bsagentfile is not None:
+        bsagt = load_agent_from_file(bsagentfile, "BeliefStateAgent")(args)
+        set_agent_rng(bsagt, bsagent_rng)
+        startingIndex = nghosts + 1
+
+    game = ClassicGameRules(0).newGame(
+        get_layout(layout), agent, gagts, bsagt, None, quiet=True,
+        hiddenGhosts=args.hiddenghosts, edibleGhosts=args.edibleghosts,
+        startingIndex=startingIndex, headless=True, rng=layout_rng)
+    result = game.run(maxMoves)
+
+    record = {"layout": layout,
+              "ghost": ghost,
+              "seed": seed,
+              "nghosts": nghosts,
+              "score": result.score,
+              "moves": result.numMoves,
+              "win": result.win,
+              "lose": result.lose,
+              "agent_times": result.agentTimes}
+    if bsagt is not None:
+        record["max_belief"], record["belief_error"] = \
+            belief_metrics(game.state)
+    return record
+
+
+def _run_job(job):
+    return run_experiment(**job)
+
+
+def make_jobs(layouts, ghosts, ngames, seed=0, **options):
+    """
+    Returns the `run_experiment` keyword arguments of `ngames` games,
+    with seeds `seed`, ..., `seed + ngames - 1`, for every layout and
+    ghost type.
+    """
+    return [dict(layout=layout, ghost=ghost, seed=seed + i, **options)
+            for layout in layouts
+            for ghost in ghosts
+            for i in range(ngames)]
+
+
+def run_experiments(jobs, processes=None, chunksize=1):
+    """
+    Plays games over a pool of worker processes.
+
+    Arguments:
+    ----------
+    - `jobs`: a list of `run_experiment` keyword arguments,
+      see `make_jobs`.
+    - `processes`: number of worker processes, the number of CPUs by
+      default. With 1, the games are played in this process.
+
+    Return:
+    -------
+    - The list of the `run_experiment` results, in the order of `jobs`.
+    """
+    if processes == 1:
+        return [_run_job(job) for job in jobs]
+
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_run_job, jobs, chunksize)
@@ -27,7 +27,7 @@ import traceback
 import sys
 import pacman_module as pacmodule
 import numpy as np
-from copy import deepcopy
+from collections import namedtuple
 
 #######################
 # Parts worth reading #
@@ -90,6 +90,7 @@ class Configuration:
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
     """
+    __slots__ = ('pos', 'direction', 'visible')
 
     def __init__(self, pos, direction, visible=True):
         self.pos = pos
@@ -142,6 +143,8 @@ class AgentState:
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
+    __slots__ = ('start', 'configuration', 'agtType', 'isPacman',
+                 'scaredTimer', 'numCarrying', 'numReturned')
 
     def __init__(self, startConfiguration, agtType):
         self.start = startConfiguration
@@ -190,9 +193,9 @@ class AgentState:
 
 class Grid:
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
-    via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
-    y vertical and the origin (0,0) in the bottom left corner.
+    A 2-dimensional array of booleans backed by a numpy array.  Data is
+    accessed via grid[x][y] where (x,y) are positions on a Pacman map with
+    x horizontal, y vertical and the origin (0,0) in the bottom left corner.
 
     The __str__ method constructs an output that is oriented like a pacman board.
     """
@@ -209,19 +212,34 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(
-            height)] for x in range(width)]
+        self.frozen = False
+        self.data = np.full((width, height), initialValue, dtype=bool)
+        # rows served by grid[x]: numpy views of a mutable grid,
+        # tuples of plain booleans once frozen
+        self._rows = self.data
+        self._packed = None
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        return self._rows[i]
 
     def __setitem__(self, key, item):
+        if self.frozen:
+            raise TypeError('Frozen grids cannot be modified')
         self.data[key] = item
 
+    def __array__(self, dtype=None, copy=None):
+        """
+        Exports the grid to numpy, without copying unless asked to.
+        The array of a frozen grid is read-only.
+        """
+        if copy:
+            return np.array(self.data, dtype=dtype)
+        return np.asarray(self.data, dtype=dtype)
+
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)]
+        out = [['T' if self.data[x, y] else 'F' for x in range(self.width)]
                for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
@@ -229,22 +247,33 @@ class Grid:
     def __eq__(self, other):
         if other is None:
             return False
-        return self.data == other.data
+        if self.data is other.data:
+            return True
+        return self.data.shape == other.data.shape and \
+            self._getPacked() == other._getPacked()
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        return hash((self.width, self.height, self._getPacked()))
+
+    def _getPacked(self):
+        """
+        Returns the cells packed 8 per byte.  Frozen grids cannot change,
+        so their packing is computed once.
+        """
+        if self._packed is not None:
+            return self._packed
+        packed = np.packbits(self.data).tobytes()
+        if self.frozen:
+            self._packed = packed
+        return packed
 
     def copy(self):
+        """
+        Returns a mutable copy, even of a frozen grid.
+        """
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g.data = self.data.copy()
+        g._rows = g.data
         return g
 
     def deepCopy(self):
@@ -253,40 +282,45 @@ class Grid:
     def shallowCopy(self):
         g = Grid(self.width, self.height)
         g.data = self.data
+        g._rows = self._rows
+        g._packed = self._packed
+        g.frozen = self.frozen
         return g
 
+    def freeze(self):
+        """
+        Makes the grid immutable, so that it can be shared instead of
+        copied.  Frozen grids can still be copied into mutable ones.
+        """
+        self.data.flags.writeable = False
+        self._rows = tuple(tuple(x) for x in self.data.tolist())
+        self.frozen = True
+
     def count(self, item=True):
-        return sum([x.count(item) for x in self.data])
+        return int(np.count_nonzero(self.data == item))
 
     def asList(self, key=True):
-        list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key:
-                    list.append((x, y))
-        return list
+        return [tuple(p) for p in np.argwhere(self.data == key).tolist()]
 
     def packBits(self):
         """
         Returns an efficient int list representation
 
         (width, height, bitPackedInts...)
+
+        Cell x*height+y is stored, most significant bit first, in the
+        CELLS_PER_INT bits of the int of index (x*height+y) // CELLS_PER_INT.
         """
-        bits = [self.width, self.height]
-        currentInt = 0
-        for i in range(self.height * self.width):
-            bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-            x, y = self._cellIndexToPosition(i)
-            if self[x][y]:
-                currentInt += 2 ** bit
-            if (i + 1) % self.CELLS_PER_INT == 0:
-                bits.append(currentInt)
-                currentInt = 0
-        bits.append(currentInt)
-        return tuple(bits)
+        nInts = self.width * self.height // self.CELLS_PER_INT + 1
+        cells = np.zeros(nInts * self.CELLS_PER_INT, dtype=np.int64)
+        cells[:self.width * self.height] = self.data.ravel()
+        weights = 1 << np.arange(self.CELLS_PER_INT - 1, -1, -1,
+                                 dtype=np.int64)
+        ints = cells.reshape((nInts, self.CELLS_PER_INT)) @ weights
+        return tuple([self.width, self.height] + ints.tolist())
 
     def _cellIndexToPosition(self, index):
-        x = index / self.height
+        x = index // self.height
         y = index % self.height
         return x, y
 
@@ -294,27 +328,13 @@ class Grid:
         """
         Fills in data from a bit-level representation
         """
-        cell = 0
-        for packed in bits:
-            for bit in self._unpackInt(packed, self.CELLS_PER_INT):
-                if cell == self.width * self.height:
-                    break
-                x, y = self._cellIndexToPosition(cell)
-                self[x][y] = bit
-                cell += 1
-
-    def _unpackInt(self, packed, size):
-        bools = []
-        if packed < 0:
+        packed = np.asarray(bits, dtype=np.int64).reshape(-1, 1)
+        if (packed < 0).any():
             raise ValueError("must be a positive integer")
-        for i in range(size):
-            n = 2 ** (self.CELLS_PER_INT - i - 1)
-            if packed >= n:
-                bools.append(True)
-                packed -= n
-            else:
-                bools.append(False)
-        return bools
+        shifts = np.arange(self.CELLS_PER_INT - 1, -1, -1, dtype=np.int64)
+        cells = ((packed >> shifts) & 1).astype(bool).ravel()
+        self.data[:] = cells[:self.width * self.height].reshape(
+            (self.width, self.height))
 
 
 def reconstituteGrid(bitRep):
@@ -410,8 +430,8 @@ class Actions:
         return neighbors
     getLegalNeighbors = staticmethod(getLegalNeighbors)
 
-    def getSuccessor(position, action):
-        dx, dy = Actions.directionToVector(action)
+    def getSuccessor(position, action, speed=1.0):
+        dx, dy = Actions.directionToVector(action, speed)
         x, y = position
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
@@ -421,22 +441,36 @@ class GameStateData:
     """
 
     """
+    __slots__ = ('food', 'capsules', 'agentStates', 'layout', 'score',
+                 'scoreChange', 'beliefStates', '_eaten', '_beliefMode',
+                 '_foodEaten', '_foodAdded', '_capsuleEaten', '_agentMoved',
+                 '_lose', '_win', '_ownedAgentStates', '_ownsCapsules',
+                 '_ownsEaten')
 
     def __init__(self, prevState=None):
         """
-        Generates a new data packet by copying information from its predecessor.
+        Generates a new data packet from its predecessor.
+
+        Successors are copy-on-write: the food grid, capsules, agent
+        states, eaten flags and belief states are shared with the
+        predecessor, and a component is only copied the first time it
+        is modified, through `ownAgentState`, `ownCapsules`, `ownEaten`
+        or by assigning a new object (e.g. a new food grid).
         """
         if prevState is not None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates(prevState.agentStates)
+            self.food = prevState.food
+            self.capsules = prevState.capsules
+            self.agentStates = list(prevState.agentStates)
             self.layout = prevState.layout
-            self._eaten = deepcopy(prevState._eaten)
+            self._eaten = prevState._eaten
+            self._beliefMode = prevState._beliefMode
             self.score = prevState.score
             try:
-                self.beliefStates = np.copy(prevState.beliefStates)
+                self.beliefStates = prevState.beliefStates
             except BaseException:
                 pass
+        else:
+            self._beliefMode = False
 
         self._foodEaten = None
         self._foodAdded = None
@@ -445,11 +479,18 @@ class GameStateData:
         self._lose = False
         self._win = False
         self.scoreChange = 0
+        self._ownedAgentStates = set()
+        self._ownsCapsules = False
+        self._ownsEaten = False
 
     def deepCopy(self):
         state = GameStateData(self)
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates(self.agentStates)
+        state._eaten = self._eaten[:]
+        # The layout is immutable and shared by all states
+        state.layout = self.layout
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
@@ -458,8 +499,64 @@ class GameStateData:
             state.beliefStates = np.copy(self.beliefStates)
         except BaseException:
             pass
+        state._ownedAgentStates = set(range(len(state.agentStates)))
+        state._ownsCapsules = True
+        state._ownsEaten = True
         return state
 
+    def ownAgentState(self, index):
+        """
+        Returns the agent state at `index`, copied first if it is
+        still shared with the predecessor, so that it can be modified.
+        """
+        if index not in self._ownedAgentStates:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgentStates.add(index)
+        return self.agentStates[index]
+
+    def ownCapsules(self):
+        """
+        Returns the list of capsules, copied first if it is still
+        shared with the predecessor, so that it can be modified.
+        """
+        if not self._ownsCapsules:
+            self.capsules = self.capsules[:]
+            self._ownsCapsules = True
+        return self.capsules
+
+    def ownEaten(self):
+        """
+        Returns the list of eaten flags, copied first if it is still
+        shared with the predecessor, so that it can be modified.
+        """
+        if not self._ownsEaten:
+            self._eaten = self._eaten[:]
+            self._ownsEaten = True
+        return self._eaten
+
+    def pack(self):
+        """
+        Returns a compact representation of the state, made of tuples of
+        plain values, that is cheap to pickle, e.g. to ship states between
+        processes or to store replays.  The layout is left out, see
+        `reconstituteStateData`.
+
+        (foodBits, capsules, agentStates, eaten, score, win, lose,
+         beliefMode, beliefStates)
+        """
+        agentStates = tuple(
+            (agentState.agtType, agentState.isPacman, agentState.scaredTimer,
+             agentState.numCarrying, agentState.numReturned,
+             _packConfiguration(agentState.start),
+             _packConfiguration(agentState.configuration))
+            for agentState in self.agentStates)
+        beliefStates = getattr(self, 'beliefStates', None)
+        if beliefStates is not None:
+            beliefStates = np.asarray(beliefStates)
+        return (self.food.packBits(), tuple(self.capsules), agentStates,
+                tuple(self._eaten), self.score, self._win, self._lose,
+                self._beliefMode, beliefStates)
+
     def copyAgentStates(self, agentStates):
         copiedStates = []
         for agentState in agentStates:
@@ -511,13 +608,11 @@ class GameStateData:
 
     def __str__(self):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
         if isinstance(self.food, type((1, 2))):
             self.food = reconstituteGrid(self.food)
-        for x in range(width):
-            for y in range(height):
-                food, walls = self.food, self.layout.walls
-                map[x][y] = self._foodWallStr(food[x][y], walls[x][y])
+        food, walls = self.food, self.layout.walls
+        map = [[self._foodWallStr(food[x][y], walls[x][y])
+                for y in range(height)] for x in range(width)]
 
         for agentState in self.agentStates:
             if agentState is None:
@@ -534,7 +629,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        out = [''.join(map[x][y] for x in range(width))
+               for y in reversed(range(height))]
+        return '\n'.join(out) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr(self, hasFood, hasWall):
         if hasFood:
@@ -569,14 +666,17 @@ class GameStateData:
             numGhostAgents,
             isGhostVisible=True,
             edibleGhosts=False,
-            beliefStateAgent=None):
+            beliefStateAgent=None,
+            rng=None):
         """
         Creates an initial game state from a layout array (see layout.py).
+        Random ghost positions are drawn from `rng`, see
+        `layout.getRandomLegalGhostPosition`.
         """
 
         self.food = layout.food.copy()
         #self.capsules = []
-        self.capsules = layout.capsules[:]
+        self.capsules = list(layout.capsules)
         self.layout = layout
         self.score = 0
         self.scoreChange = 0
@@ -593,7 +693,7 @@ class GameStateData:
                     # If beliefstateagent is specified, it is Project Part III
                     # Here we choose a random initial location
                     if beliefStateAgent is not None:
-                        pos = layout.getRandomLegalGhostPosition()
+                        pos = layout.getRandomLegalGhostPosition(rng)
             agt = AgentState(
                 Configuration(
                     pos,
@@ -604,6 +704,8 @@ class GameStateData:
                 agt.scaredTimer = float("inf")
             self.agentStates.append(agt)
         self._eaten = [False for a in self.agentStates]
+        # Belief-tracking game (Project Part III) rather than classic game
+        self._beliefMode = beliefStateAgent is not None
         if beliefStateAgent is not None:
             """
             Create a uniform prior on the belief state
@@ -629,6 +731,54 @@ class GameStateData:
                                  for _ in range(numGhosts)]
 
 
+def _packConfiguration(configuration):
+    if configuration is None:
+        return None
+    return (configuration.pos, configuration.direction,
+            configuration.visible)
+
+
+def _unpackConfiguration(packed):
+    if packed is None:
+        return None
+    return Configuration(*packed)
+
+
+def reconstituteStateData(packed, layout):
+    """
+    Rebuilds the GameStateData packed by `GameStateData.pack` on `layout`.
+    """
+    food, capsules, agentStates, eaten, score, win, lose, beliefMode, \
+        beliefStates = packed
+
+    state = GameStateData()
+    state.layout = layout
+    state.food = reconstituteGrid(food)
+    state.food.freeze()
+    state.capsules = list(capsules)
+    state.agentStates = []
+    for agtType, isPacman, scaredTimer, numCarrying, numReturned, start, \
+            configuration in agentStates:
+        agentState = AgentState(_unpackConfiguration(start), agtType)
+        agentState.configuration = _unpackConfiguration(configuration)
+        agentState.isPacman = isPacman
+        agentState.scaredTimer = scaredTimer
+        agentState.numCarrying = numCarrying
+        agentState.numReturned = numReturned
+        state.agentStates.append(agentState)
+    state._eaten = list(eaten)
+    state.score = score
+    state._win = win
+    state._lose = lose
+    state._beliefMode = beliefMode
+    if beliefStates is not None:
+        state.beliefStates = np.copy(beliefStates)
+    state._ownedAgentStates = set(range(len(state.agentStates)))
+    state._ownsCapsules = True
+    state._ownsEaten = True
+    return state
+
+
 try:
     import boinc
     _BOINC_ENABLED = True
@@ -649,7 +799,8 @@ class Game:
             startingIndex=0,
             muteAgents=False,
             catchExceptions=False,
-            oracleBeliefStateAgent=None):
+            oracleBeliefStateAgent=None,
+            metrics=None):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -665,6 +816,8 @@ class Game:
         import io
         self.agentOutput = [io.StringIO() for agent in agents]
         self.oracleBeliefStateAgent = oracleBeliefStateAgent
+        # Recorder of the belief state metrics, see metrics.py
+        self.metrics = metrics
 
     def getProgress(self):
         if self.gameOver:
@@ -707,6 +860,8 @@ class Game:
         """
         self.display.initialize(self.state.data)
         self.numMoves = 0
+        if self.metrics is not None:
+            self.metrics.startGame()
 
         agentIndex = self.startingIndex
         numAgents = len(self.agents)
@@ -734,6 +889,7 @@ class Game:
                     action = agent.get_action(observation, previous_action)
                 elif (agentIndex == numAgents-1 and type(self.agents[numAgents-1]).__name__ == "BeliefStateAgent"):
                     action, evidence = agent.get_action(observation)
+                    latency = time.time() - t
                     if self.oracleBeliefStateAgent is not None:
                         oracleAction = self.oracleBeliefStateAgent.get_action(observation, evidence)
 
@@ -741,6 +897,9 @@ class Game:
                             print("step {}: OK".format(self.numMoves))
                         else:
                             print("step {}: Not OK".format(self.numMoves))
+                    if self.metrics is not None and self.metrics.record(
+                            action, observation.getGhostPositions(), latency):
+                        self.gameOver = True
                 else:
                     action = agent.get_action(observation)
             else:
@@ -783,5 +942,91 @@ class Game:
 
         totalScore = self.state.getScore()
 
+        if self.metrics is not None:
+            self.metrics.flush()
         self.display.finish()
         return totalScore, totalComputationTime, totalExpandedNodes
+
+
+GameResult = namedtuple('GameResult', ['score', 'numMoves', 'win', 'lose',
+                                       'agentTimes', 'expandedNodes'])
+GameResult.__doc__ = """
+Outcome of a headless game: the final score, the number of rounds of
+moves played, whether pacman won or lost (both are False when the game
+was stopped early), the total time spent in `get_action` by each agent
+in seconds and the total number of nodes expanded by the agents.
+"""
+
+
+class HeadlessGame(Game):
+    """
+    A Game for batch simulations: no display, no output muting, and
+    agents observe a read-only view of the state (see
+    `GameState.getObservation`) instead of a deep copy.
+    """
+
+    def run(self, maxMoves=None):
+        """
+        Plays the game until it ends, or until `maxMoves` rounds of moves
+        have been played.
+
+        Return:
+        -------
+        - A `GameResult`.
+        """
+        self.numMoves = 0
+
+        agentIndex = self.startingIndex
+        numAgents = len(self.agents)
+        beliefGame = \
+            type(self.agents[-1]).__name__ == "BeliefStateAgent"
+        previous_action = Directions.STOP
+        totalExpandedNodes = 0
+        GameState = pacmodule.pacman.GameState
+        if self.metrics is not None:
+            self.metrics.startGame()
+
+        while not self.gameOver:
+            if maxMoves is not None and self.numMoves >= maxMoves:
+                break
+
+            agent = self.agents[agentIndex]
+            observation = self.state.getObservation()
+            GameState.resetNodeExpansionCounter()
+            t = time.perf_counter()
+            if beliefGame and agentIndex == 0:
+                action = agent.get_action(observation, previous_action)
+            elif beliefGame and agentIndex == numAgents - 1:
+                action, _ = agent.get_action(observation)
+            else:
+                action = agent.get_action(observation)
+            latency = time.perf_counter() - t
+            self.totalAgentTimes[agentIndex] += latency
+            if beliefGame and agentIndex == numAgents - 1 and \
+                    self.metrics is not None and self.metrics.record(
+                        action, observation.getGhostPositions(), latency):
+                self.gameOver = True
+            totalExpandedNodes += GameState.countExpanded
+
+            if not self.state.isLegalAction(agentIndex, action):
+                action = previous_action
+            if not self.state.isLegalAction(agentIndex, action):
+                action = Directions.STOP
+
+            previous_action = action
+            self.state = self.state.generateSuccessor(agentIndex, action)
+
+            self.rules.process(self.state, self)
+            if agentIndex == numAgents - 1:
+                self.numMoves += 1
+            agentIndex = (agentIndex + 1) % numAgents
+
+        # Forget the states explored during this game, so that memory
+        # stays bounded over a batch of games
+        GameState.getAndResetExplored()
+        if self.metrics is not None:
+            self.metrics.flush()
+
+        return GameResult(self.state.getScore(), self.numMoves,
+                          self.state.isWin(), self.state.isLose(),
+                          list(self.totalAgentTimes), totalExpandedNodes)
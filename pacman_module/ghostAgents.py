@@ -23,17 +23,20 @@ import numpy as np
 
 
 class GhostAgent(Agent):
-    def __init__(self, index, args):
+    def __init__(self, index, args, rng=None):
         """
         Arguments:
         ----------
         - `args`: Namespace of arguments from command-line prompt.
         - `index` : Strictly positive integer index of the ghost agent.
+        - `rng`: numpy Generator from which moves are drawn, the global
+          `random` state if None.
         """
         if index < 1:
             raise IndexError("Index must be >= 1")
         self.index = index
         self.args = args
+        self.rng = rng
 
     def get_action(self, state):
         """
@@ -53,7 +56,7 @@ class GhostAgent(Agent):
         if len(dist) == 0:
             return Directions.STOP
         else:
-            return util.chooseFromDistribution(dist)
+            return util.chooseFromDistribution(dist, self.rng)
 
     def getDistribution(self, state):
         """
@@ -73,38 +76,74 @@ class GhostAgent(Agent):
         util.raiseNotDefined()
 
 
-class ConfusedGhost(GhostAgent):
-    """A stochastic ghost which goes anywhere with equal probability."""
-
-    def getDistribution(self, state):
+# Moves of the policy tables, in the order of their last axis
+POLICY_MOVES = ((Directions.NORTH, (0, 1)),
+                (Directions.EAST, (1, 0)),
+                (Directions.SOUTH, (0, -1)),
+                (Directions.WEST, (-1, 0)))
+
+
+def fleeingPolicyTable(walls, pacmanPosition, weight):
+    """
+    Computes the policy of a `FleeingGhost` on every cell of the maze,
+    when the ghost may move to any free neighbor cell, as in belief
+    state games.  Tables are dense and not cached: callers keep the
+    models they derive from them (see `BeliefStateAgent`).
+
+    Arguments:
+    ----------
+    - `walls`: the `game.Grid` of walls.
+    - `pacmanPosition`: the (x, y) position of pacman.
+    - `weight`: the weight of the moves that do not bring the ghost
+      closer to pacman, relative to the others.
+
+    Return:
+    -------
+    - A numpy array of size [width, height, 4] of the probabilities of
+      the moves of `POLICY_MOVES` from every cell, 0 on walls and for
+      moves into walls.
+    """
+    free = np.logical_not(np.asarray(walls))
+    w, h = free.shape
+    px, py = pacmanPosition
+    x, y = np.indices((w, h))
+    distance = np.abs(x - px) + np.abs(y - py)
+    padded = np.pad(free, 1)
+
+    table = np.zeros((w, h, len(POLICY_MOVES)))
+    for k, (_, (dx, dy)) in enumerate(POLICY_MOVES):
+        target = free & padded[1 + dx:1 + dx + w, 1 + dy:1 + dy + h]
+        farther = np.abs(x + dx - px) + np.abs(y + dy - py) >= distance
+        table[..., k] = np.where(target, np.where(farther, weight, 1), 0)
+
+    norm = table.sum(axis=2, keepdims=True)
+    np.divide(table, norm, out=table, where=norm > 0)
+    return table
+
+
+class FleeingGhost(GhostAgent):
+    """A stochastic ghost which gives a weight `weight` to the actions that
+       do not bring him closer to Pacman, and 1 to the others."""
+
+    # Fixed by subclasses, read from `args.ghostweight` otherwise
+    weight = None
+
+    def __init__(self, index, args, weight=None, rng=None):
         """
-        Given a ghost game state,
-        returns a discrete probability distribution over legal moves
-
         Arguments:
         ----------
-        - `state`: the current game state.
-                   See FAQ and class `pacman.GameState`.
-
-        Return:
-        -------
-        - A `util.Counter` object which represents a discrete
-          probability distribution over legal moves.
+        - `args`: Namespace of arguments from command-line prompt.
+        - `index` : Strictly positive integer index of the ghost agent.
+        - `weight`: weight of the actions that do not bring the ghost
+          closer to Pacman. Defaults to the class weight, or to
+          `args.ghostweight`.
+        - `rng`: see `GhostAgent`.
         """
-        dist = util.Counter()
-        legal = state.getLegalActions(self.index)
-        if Directions.STOP in legal:
-            legal.remove(Directions.STOP)
-        for a in legal:
-            dist[a] = 1.0
-        dist.normalize()
-
-        return dist
-
-
-class AfraidGhost(GhostAgent):
-    """A stochastic ghost which favors actions that makes him move away from
-       Pacman."""
+        super().__init__(index, args, rng)
+        if weight is not None:
+            self.weight = weight
+        elif self.weight is None:
+            self.weight = getattr(args, 'ghostweight', 1)
 
     def getDistribution(self, state):
         """
@@ -125,54 +164,49 @@ class AfraidGhost(GhostAgent):
         legal = state.getLegalActions(self.index)
         if Directions.STOP in legal:
             legal.remove(Directions.STOP)
+        if self.weight == 1:
+            for a in legal:
+                dist[a] = 1.0
+            dist.normalize()
+            return dist
+
         pacman_position = state.getPacmanPosition()
         ghost_current_position = state.getGhostPosition(self.index)
         current_distance = manhattanDistance(
             ghost_current_position, pacman_position)
         for a in legal:
-            succ_state = state.generateSuccessor(self.index, a)
-            ghost_succ_position = succ_state.getGhostPosition(self.index)
+            ghost_succ_position = state.getGhostSuccessorPosition(
+                self.index, a)
             succ_distance = manhattanDistance(
                 ghost_succ_position, pacman_position)
-            dist[a] = 2 if succ_distance >= current_distance else 1
+            dist[a] = self.weight if succ_distance >= current_distance else 1
         dist.normalize()
 
         return dist
 
+    def getPolicyTable(self, walls, pacmanPosition):
+        """
+        Returns the policy of the ghost on every cell of the maze, see
+        `fleeingPolicyTable`.
+        """
+        return fleeingPolicyTable(walls, tuple(pacmanPosition), self.weight)
+
 
-class ScaredGhost(GhostAgent):
-    """A stochastic ghost which favors actions that makes him move AWAY from
+class ConfusedGhost(FleeingGhost):
+    """A stochastic ghost which goes anywhere with equal probability."""
+
+    weight = 1
+
+
+class AfraidGhost(FleeingGhost):
+    """A stochastic ghost which favors actions that makes him move away from
        Pacman."""
 
-    def getDistribution(self, state):
-        """
-        Given a ghost game state,
-        returns a discrete probability distribution over legal moves
+    weight = 2
 
-        Arguments:
-        ----------
-        - `state`: the current game state.
-                   See FAQ and class `pacman.GameState`.
 
-        Return:
-        -------
-        - A `util.Counter` object which represents a discrete
-          probability distribution over legal moves.
-        """
-        dist = util.Counter()
-        legal = state.getLegalActions(self.index)
-        if Directions.STOP in legal:
-            legal.remove(Directions.STOP)
-        pacman_position = state.getPacmanPosition()
-        ghost_current_position = state.getGhostPosition(self.index)
-        current_distance = manhattanDistance(
-            ghost_current_position, pacman_position)
-        for a in legal:
-            succ_state = state.generateSuccessor(self.index, a)
-            ghost_succ_position = succ_state.getGhostPosition(self.index)
-            succ_distance = manhattanDistance(
-                ghost_succ_position, pacman_position)
-            dist[a] = 2**3 if succ_distance >= current_distance else 1
-        dist.normalize()
+class ScaredGhost(FleeingGhost):
+    """A stochastic ghost which favors actions that makes him move AWAY from
+       Pacman."""
 
-        return dist
+    weight = 2**3
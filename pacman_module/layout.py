@@ -14,6 +14,7 @@
 
 from .util import manhattanDistance
 from .game import Grid
+from .game import Actions, Configuration, Directions
 import os
 import random
 from functools import reduce
@@ -24,6 +25,9 @@ VISIBILITY_MATRIX_CACHE = {}
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    Layouts are immutable once built: the wall and food grids are frozen
+    and the layout is shared, not copied, by every game state.
     """
 
     def __init__(self, layoutText):
@@ -38,10 +42,46 @@ class Layout:
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
         # self.initializeVisibilityMatrix()
+        self.walls.freeze()
+        self.food.freeze()
+        self.capsules = tuple(self.capsules)
+        self.agentPositions = tuple(self.agentPositions)
+        self.legalActions = self._buildLegalActions()
+        self.neighbors = {
+            cell: {action: Actions.getSuccessor(cell, action)
+                   for action in actions}
+            for cell, actions in self.legalActions.items()}
 
     def getNumGhosts(self):
         return self.numGhosts
 
+    def _buildLegalActions(self):
+        """
+        Returns the actions possible from every free cell that is not on
+        the border of the maze, see `Actions.getPossibleActions`.
+        """
+        return {(x, y): tuple(Actions.getPossibleActions(
+            Configuration((x, y), Directions.STOP), self.walls))
+            for x, y in self.walls.asList(False)
+            if 0 < x < self.width - 1 and 0 < y < self.height - 1}
+
+    def getNeighbors(self, position):
+        """
+        Returns a dictionary mapping the actions possible from an inner
+        free cell to the cell they lead to, None for other positions.
+        """
+        return self.neighbors.get(position)
+
+    def getPossibleActions(self, config):
+        """
+        Same as `Actions.getPossibleActions(config, self.walls)`, read
+        from a precomputed table when the agent stands on a cell.
+        """
+        actions = self.legalActions.get(config.pos)
+        if actions is None:
+            return Actions.getPossibleActions(config, self.walls)
+        return list(actions)
+
     def initializeVisibilityMatrix(self):
         global VISIBILITY_MATRIX_CACHE
         if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
@@ -90,7 +130,17 @@ class Layout:
 
     def getPacmanPosition(self): return self.pacPos
 
-    def getRandomLegalGhostPosition(self):
+    def getRandomLegalGhostPosition(self, rng=None):
+        """
+        Draws a free cell other than pacman's, from the numpy Generator
+        `rng` if given, from the global `random` state otherwise.
+        """
+        if rng is not None:
+            x, y = rng.integers(self.width - 1), rng.integers(self.height - 1)
+            while self.isWall((x, y)) or (x, y) == self.pacPos:
+                x = rng.integers(self.width - 1)
+                y = rng.integers(self.height - 1)
+            return (int(x), int(y))
         x = random.choice(list(range(self.width-1)))
         y = random.choice(list(range(self.height-1)))
         while self.isWall((x, y)) or (x,y) == self.pacPos:
@@ -117,7 +167,8 @@ class Layout:
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        # Layouts are immutable, there is nothing to copy
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -0,0 +1,153 @@
+"""
+Streaming recorder of the belief state metrics of games.
+
+Each update of the belief state agent appends one record per ghost.
+Records are buffered and written by chunks to a single file, as a
+sequence of numpy structured arrays (see `loadMetrics`), so that long
+batches of games never hold all their metrics in memory.
+"""
+import numpy as np
+
+RECORD_TYPE = np.dtype([('game', np.int64),
+                        ('step', np.int64),
+                        ('ghost', np.int64),
+                        ('maxBelief', np.float64),
+                        ('error', np.int64),
+                        ('entropy', np.float64),
+                        ('latency', np.float64)])
+
+
+def beliefMetrics(beliefStates, ghostPositions):
+    """
+    Measures belief states against the true positions of the ghosts.
+
+    Arguments:
+    ----------
+    - `beliefStates`: the Z belief states, of size [Z, width, height].
+    - `ghostPositions`: the Z true (x, y) positions of the ghosts,
+      negative for ghosts that have been eaten.
+
+    Return:
+    -------
+    - The maximum probability of each belief state.
+    - The manhattan distance between each ghost and the most likely
+      cell of its belief state, -1 for ghosts that have been eaten.
+    - The entropy of each belief state, in nats.
+    """
+    beliefs = np.asarray(beliefStates, dtype=float)
+    flat = beliefs.reshape((len(beliefs), -1))
+    cells = flat.argmax(axis=1)
+    maxBelief = flat[np.arange(len(flat)), cells]
+
+    x, y = np.unravel_index(cells, beliefs.shape[1:])
+    positions = np.asarray(ghostPositions).reshape((-1, 2))
+    error = np.abs(positions[:, 0] - x) + np.abs(positions[:, 1] - y)
+    error[positions[:, 0] < 0] = -1
+
+    logFlat = np.log(flat, out=np.zeros_like(flat), where=flat > 0)
+    entropy = -(flat * logFlat).sum(axis=1)
+
+    return maxBelief, error, entropy
+
+
+def loadMetrics(path):
+    """
+    Returns all the records written by a `MetricsRecorder` to `path`,
+    as a numpy structured array of `RECORD_TYPE`.
+    """
+    chunks = []
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                chunks.append(np.load(f))
+            except EOFError:
+                break
+    if not chunks:
+        return np.empty(0, dtype=RECORD_TYPE)
+    return np.concatenate(chunks)
+
+
+class MetricsRecorder:
+    """
+    Records the belief state metrics of games, see `beliefMetrics`,
+    with the latency of each belief state update in seconds.
+
+    When `path` is None, the records are kept in memory and returned
+    by `getRecords`.  When `maxSteps` is given, `record` asks the game
+    to stop once that many updates have been recorded.
+    """
+
+    def __init__(self, path=None, chunkSize=4096, maxSteps=None):
+        self.path = path
+        self.chunkSize = chunkSize
+        self.maxSteps = maxSteps
+        self.game = -1
+        self.step = 0
+        self._buffer = []
+        self._buffered = 0
+        self._chunks = []
+        self._file = None
+
+    def startGame(self):
+        self.game += 1
+        self.step = 0
+
+    def record(self, beliefStates, ghostPositions, latency):
+        """
+        Appends the records of one belief state update.
+
+        Return:
+        -------
+        - True if the game should stop.
+        """
+        if len(beliefStates) > 0:
+            maxBelief, error, entropy = beliefMetrics(beliefStates,
+                                                      ghostPositions)
+            rows = np.empty(len(maxBelief), dtype=RECORD_TYPE)
+            rows['game'] = self.game
+            rows['step'] = self.step
+            rows['ghost'] = np.arange(1, len(rows) + 1)
+            rows['maxBelief'] = maxBelief
+            rows['error'] = error
+            rows['entropy'] = entropy
+            rows['latency'] = latency
+            self._buffer.append(rows)
+            self._buffered += len(rows)
+            if self._buffered >= self.chunkSize:
+                self.flush()
+
+        self.step += 1
+        return self.maxSteps is not None and self.step >= self.maxSteps
+
+    def flush(self):
+        """
+        Writes the buffered records as one chunk.
+        """
+        if not self._buffer:
+            return
+        chunk = np.concatenate(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        if self.path is None:
+            self._chunks.append(chunk)
+            return
+        if self._file is None:
+            self._file = open(self.path, 'wb')
+        np.save(self._file, chunk)
+        self._file.flush()
+
+    def getRecords(self):
+        """
+        Returns the records kept in memory, when `path` is None.
+        """
+        self.flush()
+        if not self._chunks:
+            return np.empty(0, dtype=RECORD_TYPE)
+        return np.concatenate(self._chunks)
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
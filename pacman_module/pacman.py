@@ -41,8 +41,10 @@ The keys are 'a', 's', 'd', and 'w' to move (or arrow keys).  Have fun!
 """
 from .game import GameStateData
 from .game import Game
+from .game import HeadlessGame
 from .game import Directions
 from .game import Actions
+from .game import Configuration
 from .util import nearestPoint
 from .util import manhattanDistance
 from . import textDisplay, graphicsDisplay
@@ -107,10 +109,21 @@ class GameState:
         if self.isWin() or self.isLose():
             return []
 
-        if agentIndex == 0:  # Pacman is moving
-            return PacmanRules.getLegalActions(self)
-        else:
-            return GhostRules.getLegalActions(self, agentIndex)
+        return list(self._getLegalActions(agentIndex))
+
+    def _getLegalActions(self, agentIndex):
+        """
+        Returns the legal actions of an agent as a tuple, computed once
+        per state.
+        """
+        legal = self._cache.get(agentIndex)
+        if legal is None:
+            if agentIndex == 0:  # Pacman is moving
+                legal = tuple(PacmanRules.getLegalActions(self))
+            else:
+                legal = tuple(GhostRules.getLegalActions(self, agentIndex))
+            self._cache[agentIndex] = legal
+        return legal
 
     def isLegalAction(self, agentIndex=0, action=Directions.STOP):
         """
@@ -123,10 +136,7 @@ class GameState:
         if self.data.agentStates[agentIndex].agtType == -1:
             return True
 
-        if agentIndex == 0:  # Pacman is moving
-            return action in PacmanRules.getLegalActions(self)
-        else:
-            return action in GhostRules.getLegalActions(self, agentIndex)
+        return action in self._getLegalActions(agentIndex)
 
     def generateSuccessor(self, agentIndex, action):
         """
@@ -141,7 +151,7 @@ class GameState:
 
         # Let agent's logic deal with its action's effects on the board
         if agentIndex == 0:  # Pacman is moving
-            if "beliefStates" not in dir(state.data):
+            if not state.data._beliefMode:
                 state.data._eaten = [
                     False for i in range(
                         state.getNumAgents())]
@@ -156,8 +166,9 @@ class GameState:
         # Time passes
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY  # Penalty for waiting around
-        else:
-            GhostRules.decrementTimer(state.data.agentStates[agentIndex])
+        elif 0 < state.data.agentStates[agentIndex].scaredTimer < np.inf:
+            # Only running timers change, others stay shared
+            GhostRules.decrementTimer(state.data.ownAgentState(agentIndex))
 
         # Resolve multi-agent effects
         GhostRules.checkDeath(state, agentIndex)
@@ -165,6 +176,8 @@ class GameState:
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
+        # Values derived while the rules applied the action are stale
+        state._cache.clear()
         GameState.explored.add(self)
         GameState.explored.add(state)
         return state
@@ -213,8 +226,13 @@ class GameState:
         return self.data.agentStates[0].getPosition()
 
     def getGhostStates(self):
-        return list(filter(lambda x: x.agtType ==
-                           1, self.data.agentStates[1:]))
+        ghostStates = self._cache.get('ghostStates')
+        if ghostStates is None:
+            ghostStates = tuple(agentState for agentState
+                                in self.data.agentStates[1:]
+                                if agentState.agtType == 1)
+            self._cache['ghostStates'] = ghostStates
+        return list(ghostStates)
 
     def getGhostState(self, agentIndex):
         if agentIndex == 0 or agentIndex >= self.getNumAgents():
@@ -226,14 +244,25 @@ class GameState:
             raise Exception("Pacman's index passed to getGhostPosition")
         return self.data.agentStates[agentIndex].getPosition()
 
+    def getGhostSuccessorPosition(self, agentIndex, action):
+        """
+        Returns the position of a ghost in the successor state after it
+        takes the action, without generating that state.
+        """
+        return GhostRules.getSuccessorPosition(self, agentIndex, action)
+
     def getGhostDirection(self, agentIndex):
         if agentIndex == 0:
             raise Exception("Pacman's index passed to getGhostPosition")
         return self.data.agentStates[agentIndex].getDirection()
 
     def getGhostPositions(self):
-        return [tuple(map(int, s.getPosition()))
-                for s in self.getGhostStates()]
+        positions = self._cache.get('ghostPositions')
+        if positions is None:
+            positions = tuple(tuple(map(int, s.getPosition()))
+                              for s in self.getGhostStates())
+            self._cache['ghostPositions'] = positions
+        return list(positions)
 
     def getGhostDirections(self):
         return [tuple(map(int, s.getDirection()))
@@ -291,6 +320,9 @@ class GameState:
 
         walls = state.getWalls()
         if walls[x][y] == True: ...
+
+        `np.asarray(state.getWalls())` views the walls as a read-only
+        numpy array of size [width, height], without copying them.
         """
         return self.data.layout.walls
 
@@ -319,12 +351,23 @@ class GameState:
             self.data = GameStateData(prevState.data)
         else:
             self.data = GameStateData()
+        # Values derived from the state, keyed by agent index for legal
+        # actions. States are not modified once built, so they are
+        # computed at most once per state.
+        self._cache = {}
 
     def deepCopy(self):
         state = GameState(self)
         state.data = self.data.deepCopy()
         return state
 
+    def getObservation(self):
+        """
+        Returns a read-only view of this state, to hand to agents
+        instead of a deep copy.
+        """
+        return GameStateView(self)
+
     def __eq__(self, other):
         """
         Allows two states to be compared.
@@ -347,16 +390,55 @@ class GameState:
             numGhostAgents=1000,
             hiddenGhosts=False,
             edibleGhosts=False,
-            beliefStateAgent=None):
+            beliefStateAgent=None,
+            rng=None):
         """
         Creates an initial game state from a layout array (see layout.py).
         """
+        self._cache.clear()
         self.data.initialize(
             layout,
             numGhostAgents,
             isGhostVisible=not hiddenGhosts,
             edibleGhosts=edibleGhosts,
-            beliefStateAgent=beliefStateAgent)
+            beliefStateAgent=beliefStateAgent,
+            rng=rng)
+
+
+class GameStateView:
+    """
+    A read-only view of a GameState, used as an agent observation.
+
+    Accessors are forwarded to the viewed state, which is never copied.
+    Attributes of the view cannot be assigned, and generating successors
+    still returns regular GameState objects.  Agents must treat the
+    objects returned by accessors (food grid, capsules, agent states)
+    as read-only as well.
+    """
+    __slots__ = ('_state',)
+
+    def __init__(self, state):
+        object.__setattr__(self, '_state', state)
+
+    def __getattr__(self, name):
+        return getattr(self._state, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Observations are read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError('Observations are read-only')
+
+    def __eq__(self, other):
+        if isinstance(other, GameStateView):
+            other = other._state
+        return self._state == other
+
+    def __hash__(self):
+        return hash(self._state)
+
+    def __str__(self):
+        return str(self._state)
 
 ############################################################################
 #                     THE HIDDEN SECRETS OF PACMAN                         #
@@ -391,7 +473,16 @@ class ClassicGameRules:
             hiddenGhosts=False,
             edibleGhosts=False,
             startingIndex=0,
-            oracleBeliefStateAgent=None):
+            oracleBeliefStateAgent=None,
+            headless=False,
+            metrics=None,
+            rng=None):
+        """
+        Creates a game, or a `HeadlessGame` if `headless` is True.
+        The belief state metrics of the game are recorded by `metrics`,
+        a `metrics.MetricsRecorder`, if given.  Random initial ghost
+        positions are drawn from the numpy Generator `rng`, if given.
+        """
 
         agents = [pacmanAgent] + ghostAgents[:layout.getNumGhosts()] + \
             ([beliefStateAgent] if beliefStateAgent is not None else [])
@@ -401,13 +492,16 @@ class ClassicGameRules:
             len(ghostAgents),
             hiddenGhosts=hiddenGhosts,
             edibleGhosts=edibleGhosts,
-            beliefStateAgent=beliefStateAgent)
-        game = Game(agents,
-                    display,
-                    self,
-                    startingIndex=startingIndex,
-                    catchExceptions=catchExceptions,
-                    oracleBeliefStateAgent=oracleBeliefStateAgent)
+            beliefStateAgent=beliefStateAgent,
+            rng=rng)
+        gameClass = HeadlessGame if headless else Game
+        game = gameClass(agents,
+                         display,
+                         self,
+                         startingIndex=startingIndex,
+                         catchExceptions=catchExceptions,
+                         oracleBeliefStateAgent=oracleBeliefStateAgent,
+                         metrics=metrics)
         game.state = initState
         self.initialState = initState.deepCopy()
         self.quiet = quiet
@@ -468,9 +562,8 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions(
-            state.getPacmanState().configuration,
-            state.data.layout.walls)
+        return state.data.layout.getPossibleActions(
+            state.data.agentStates[0].configuration)
     getLegalActions = staticmethod(getLegalActions)
 
     def applyAction(state, action):
@@ -481,7 +574,7 @@ class PacmanRules:
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.ownAgentState(0)
 
         # Update Configuration
         vector = Actions.directionToVector(action, PacmanRules.PACMAN_SPEED)
@@ -503,6 +596,7 @@ class PacmanRules:
             state.data.scoreChange += 10
             state.data.food = state.data.food.copy()
             state.data.food[x][y] = False
+            state.data.food.freeze()
             state.data._foodEaten = position
             # TODO: cache numFood?
             numFood = state.getNumFood()
@@ -512,11 +606,11 @@ class PacmanRules:
         # Eat capsule
         if(position in state.getCapsules()):
             state.data.scoreChange -= 5
-            state.data.capsules.remove(position)
+            state.data.ownCapsules().remove(position)
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range(1, len(state.data.agentStates)):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.ownAgentState(index).scaredTimer = SCARED_TIME
     consume = staticmethod(consume)
 
 
@@ -525,6 +619,8 @@ class GhostRules:
     These functions dictate how ghosts interact with their environment.
     """
     GHOST_SPEED = 1.0
+    # Position of the ghosts eaten in belief state games
+    VOID_POSITION = (-10, -10)
 
     def getLegalActions(state, ghostIndex):
         """
@@ -532,14 +628,12 @@ class GhostRules:
         reach a dead end, but can turn 90 degrees at intersections.
         """
         conf = state.getGhostState(ghostIndex).configuration
-        possibleActions = Actions.getPossibleActions(
-            conf, state.data.layout.walls)
+        possibleActions = state.data.layout.getPossibleActions(conf)
         reverse = Actions.reverseDirection(conf.direction)
-        if Directions.STOP in possibleActions and "beliefStates" not in dir(
-                state.data):
+        if Directions.STOP in possibleActions and not state.data._beliefMode:
             possibleActions.remove(Directions.STOP)
-        if "beliefStates" not in dir(
-                state.data) and reverse in possibleActions and len(possibleActions) > 1:
+        if not state.data._beliefMode and reverse in possibleActions and len(
+                possibleActions) > 1:
             possibleActions.remove(reverse)
 
         return possibleActions
@@ -551,16 +645,13 @@ class GhostRules:
         Ghosts cannot stop, and cannot turn around unless they
         reach a dead end, but can turn 90 degrees at intersections.
         """
-        conf = deepcopy(state.getGhostState(ghostIndex).configuration)
-        conf.pos = position
-        conf.direction = direction
-        possibleActions = Actions.getPossibleActions(
-            conf, state.data.layout.walls)
+        conf = Configuration(position, direction)
+        possibleActions = state.data.layout.getPossibleActions(conf)
         reverse = Actions.reverseDirection(conf.direction)
         if Directions.STOP in possibleActions:
             possibleActions.remove(Directions.STOP)
-        if "beliefStates" not in dir(
-                state.data) and reverse in possibleActions and len(possibleActions) > 1:
+        if not state.data._beliefMode and reverse in possibleActions and len(
+                possibleActions) > 1:
             possibleActions.remove(reverse)
 
         return possibleActions
@@ -573,20 +664,63 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.ownAgentState(ghostIndex)
         speed = GhostRules.GHOST_SPEED
-        if ghostState.scaredTimer > 0 and "beliefStates" not in dir(state.data):
+        if ghostState.scaredTimer > 0 and not state.data._beliefMode:
             speed /= 2.0
         vector = Actions.directionToVector(action, speed)
         ghostState.configuration = ghostState.configuration.generateSuccessor(
             vector)
     applyAction = staticmethod(applyAction)
 
+    def getSuccessorPosition(state, ghostIndex, action):
+        """
+        Returns the position of a ghost after it takes the action, as
+        `applyAction`, `decrementTimer` and `checkDeath` would leave it
+        in the successor state: scared ghosts move at half speed in
+        classic games, and a ghost eaten by pacman is sent back to its
+        start position, or out of the maze in belief state games.
+        """
+        if state.isWin() or state.isLose():
+            raise Exception('Can\'t generate a successor of a terminal state.')
+        if action not in state._getLegalActions(ghostIndex):
+            raise Exception("Illegal ghost action " + str(action))
+
+        ghostState = state.data.agentStates[ghostIndex]
+        position = ghostState.configuration.pos
+        timer = ghostState.scaredTimer
+        if timer > 0 and not state.data._beliefMode:
+            position = Actions.getSuccessor(
+                position, action, GhostRules.GHOST_SPEED / 2.0)
+        else:
+            neighbors = state.data.layout.getNeighbors(position)
+            if neighbors is not None and GhostRules.GHOST_SPEED == 1.0:
+                position = neighbors[action]
+            else:
+                position = Actions.getSuccessor(
+                    position, action, GhostRules.GHOST_SPEED)
+
+        if 0 < timer < np.inf:
+            if timer == 1:
+                position = nearestPoint(position)
+            timer -= 1
+
+        if GhostRules.canKill(state.getPacmanPosition(), position) and \
+                timer > 0:
+            if state.data._beliefMode:
+                return GhostRules.VOID_POSITION
+            return ghostState.start.pos
+        return position
+    getSuccessorPosition = staticmethod(getSuccessorPosition)
+
     def decrementTimer(ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint(
-                ghostState.configuration.pos)
+            # Configurations may be shared between states, replace it
+            configuration = ghostState.configuration
+            ghostState.configuration = Configuration(
+                nearestPoint(configuration.pos), configuration.direction,
+                configuration.visible)
         ghostState.scaredTimer = max(0, timer - 1)
     decrementTimer = staticmethod(decrementTimer)
 
@@ -598,12 +732,14 @@ class GhostRules:
                     ghostState = state.data.agentStates[index]
                     ghostPosition = ghostState.configuration.getPosition()
                     if GhostRules.canKill(pacmanPosition, ghostPosition):
-                        GhostRules.collide(state, ghostState, index)
+                        GhostRules.collide(
+                            state, state.data.ownAgentState(index), index)
         elif state.data.agentStates[agentIndex].agtType != -1:
             ghostState = state.data.agentStates[agentIndex]
             ghostPosition = ghostState.configuration.getPosition()
             if GhostRules.canKill(pacmanPosition, ghostPosition):
-                GhostRules.collide(state, ghostState, agentIndex)
+                GhostRules.collide(
+                    state, state.data.ownAgentState(agentIndex), agentIndex)
     checkDeath = staticmethod(checkDeath)
 
     def collide(state, ghostState, agentIndex):
@@ -613,10 +749,9 @@ class GhostRules:
                 state,
                 ghostState,
                 agentIndex,
-                delete="beliefStates" in dir(
-                    state.data))
-            state.data._eaten[agentIndex] = True
-            if "beliefStates" not in dir(state.data):
+                delete=state.data._beliefMode)
+            state.data.ownEaten()[agentIndex] = True
+            if not state.data._beliefMode:
                 ghostState.scaredTimer = 0
             else:
                 if np.all(state.data._eaten[1:]) and not state.data._lose:
@@ -641,7 +776,7 @@ class GhostRules:
             ghostState.configuration = ghostState.start
         else:
             voidConfiguration = deepcopy(ghostState.start)
-            voidConfiguration.pos = (-10, -10)
+            voidConfiguration.pos = GhostRules.VOID_POSITION
             ghostState.configuration = voidConfiguration
     placeGhost = staticmethod(placeGhost)
 
@@ -982,7 +1117,9 @@ def runGame(
         hiddenGhosts=False,
         edibleGhosts=False,
         startingIndex=0,
-        oracleBeliefStateAgent=None):
+        oracleBeliefStateAgent=None,
+        metrics=None,
+        rng=None):
     display = graphicsDisplay.PacmanGraphics(
         1.0, frameTime=0.1) if displayGraphics else textDisplay.NullGraphics()
     import __main__
@@ -1001,5 +1138,57 @@ def runGame(
         hiddenGhosts=hiddenGhosts,
         edibleGhosts=edibleGhosts,
         startingIndex=startingIndex,
-        oracleBeliefStateAgent=oracleBeliefStateAgent)
+        oracleBeliefStateAgent=oracleBeliefStateAgent,
+        metrics=metrics,
+        rng=rng)
     return game.run()
+
+
+def runHeadlessGame(
+        lay,
+        pacman,
+        ghosts,
+        beliefstateagent=None,
+        hiddenGhosts=False,
+        edibleGhosts=False,
+        startingIndex=0,
+        maxMoves=None,
+        metrics=None,
+        rng=None):
+    """
+    Plays a game without display nor console output, under the same
+    rules and agent interfaces as `runGame`.
+
+    Arguments:
+    ----------
+    - `lay`: a layout name or a `layout.Layout`.
+    - `maxMoves`: if not None, the game is stopped after this number
+      of rounds of moves.
+    - `metrics`: if not None, a `metrics.MetricsRecorder` recording
+      the belief state metrics of the game.
+    - `rng`: if not None, the numpy Generator from which the initial
+      ghost positions are drawn.
+
+    Return:
+    -------
+    - A `game.GameResult` with the score, the number of rounds played,
+      the outcome and the computation time of each agent.
+    """
+    if isinstance(lay, str):
+        lay = layout.getLayout(lay)
+
+    rules = ClassicGameRules(0)
+    game = rules.newGame(
+        lay,
+        pacman,
+        ghosts,
+        beliefstateagent,
+        None,
+        quiet=True,
+        hiddenGhosts=hiddenGhosts,
+        edibleGhosts=edibleGhosts,
+        startingIndex=startingIndex,
+        headless=True,
+        metrics=metrics,
+        rng=rng)
+    return game.run(maxMoves)
@@ -31,6 +31,10 @@ import inspect
 import heapq
 import random
 import io
+from bisect import bisect_left
+from itertools import accumulate
+
+import numpy as np
 
 
 class FixedRandom:
@@ -496,35 +500,72 @@ def normalize(vectorOrCounter):
         return [el / s for el in vector]
 
 
-def nSample(distribution, values, n):
-    if sum(distribution) != 1:
-        distribution = normalize(distribution)
-    rand = sorted([random.random() for i in range(n)])
-    samples = []
-    samplePos, distPos, cdf = 0, 0, distribution[0]
-    while samplePos < n:
-        if rand[samplePos] < cdf:
-            samplePos += 1
-            samples.append(values[distPos])
-        else:
-            distPos += 1
-            cdf += distribution[distPos]
-    return samples
+def cumulativeDistribution(distribution, values=None):
+    """
+      Returns (values, cdf), where cdf is the running total of the
+      normalized distribution, for repeated draws with `sampleFromCdf`.
+      Counters are ordered by key, as in `sample`.
+    """
+    if isinstance(distribution, Counter):
+        values, distribution = zip(*sorted(distribution.items()))
+    total = sum(distribution)
+    if total != 1 and total != 0:
+        total = float(total)
+        distribution = [p / total for p in distribution]
+    return values, list(accumulate(distribution))
 
 
-def sample(distribution, values=None):
-    if isinstance(distribution, Counter):
-        items = sorted(distribution.items())
-        distribution = [i[1] for i in items]
-        values = [i[0] for i in items]
-    if sum(distribution) != 1:
-        distribution = normalize(distribution)
-    choice = random.random()
-    i, total = 0, distribution[0]
-    while choice > total:
-        i += 1
-        total += distribution[i]
-    return values[i]
+def sampleFromCdf(values, cdf, rng=None):
+    """
+      Returns the first value whose cumulative probability reaches a
+      uniform draw in [0, 1), from the numpy Generator `rng` if given,
+      from the global `random` state otherwise.
+    """
+    choice = random.random() if rng is None else rng.random()
+    i = bisect_left(cdf, choice)
+    # rounding can leave the total slightly below 1
+    return values[i] if i < len(cdf) else values[-1]
+
+
+def nSample(distribution, values, n, rng=None, systematic=False):
+    """
+      Draws n values at once from a discrete distribution, which need
+      not be normalized, in the order of the draws.  When `values` is
+      None, returns the numpy array of the indices of the drawn values
+      instead.  `rng` is a numpy Generator, the global numpy random
+      state by default.  With `systematic`, the draws are n evenly
+      spaced points shifted by a single uniform draw, as in the
+      systematic resampling of particle filters, and come out sorted.
+    """
+    if rng is None:
+        rng = np.random
+    cdf = np.cumsum(distribution, dtype=float)
+    if systematic:
+        draws = (rng.random() + np.arange(n)) / n
+    else:
+        draws = rng.random(n)
+    indices = np.searchsorted(cdf, draws * cdf[-1], side='right')
+    np.minimum(indices, len(cdf) - 1, out=indices)
+    if values is None:
+        return indices
+    return [values[i] for i in indices]
+
+
+def spawnGenerators(seed, count):
+    """
+      Returns `count` independent numpy Generators spawned from the
+      SeedSequence of `seed`, an integer or a SeedSequence.  Giving each
+      consumer of randomness its own stream makes draws reproducible
+      whatever the order in which the consumers run.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(count)]
+
+
+def sample(distribution, values=None, rng=None):
+    values, cdf = cumulativeDistribution(distribution, values)
+    return sampleFromCdf(values, cdf, rng)
 
 
 def sampleFromCounter(ctr):
@@ -549,16 +590,16 @@ def flipCoin(p):
     return r < p
 
 
-def chooseFromDistribution(distribution):
+def chooseFromDistribution(distribution, rng=None):
     "Takes either a counter or a list of (prob, key) pairs and samples"
     if isinstance(distribution, dict) or isinstance(distribution, Counter):
-        return sample(distribution)
-    r = random.random()
-    base = 0.0
-    for prob, element in distribution:
-        base += prob
-        if r <= base:
-            return element
+        return sample(distribution, rng=rng)
+    distribution = list(distribution)
+    r = random.random() if rng is None else rng.random()
+    cdf = list(accumulate(prob for prob, _ in distribution))
+    i = bisect_left(cdf, r)
+    if i < len(cdf):
+        return distribution[i][1]
 
 
 def nearestPoint(pos):
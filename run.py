@@ -3,8 +3,10 @@ import os
 from argparse import ArgumentParser, ArgumentTypeError
 import random
 from pacman_module.pacman import runGame
+from pacman_module.metrics import MetricsRecorder
 from pacman_module.ghostAgents import\
-    ConfusedGhost, AfraidGhost, ScaredGhost
+    ConfusedGhost, AfraidGhost, ScaredGhost, FleeingGhost
+from pacman_module.util import spawnGenerators
 import numpy as np
 
 
@@ -46,8 +48,47 @@ ghosts = {}
 ghosts["confused"] = ConfusedGhost
 ghosts["afraid"] = AfraidGhost
 ghosts["scared"] = ScaredGhost
+ghosts["fleeing"] = FleeingGhost
 
-if __name__ == '__main__':
+
+def seed_game(seed, nghosts):
+    """
+    Spawns the independent random streams of a game from `seed`,
+    see `util.spawnGenerators`, so that a game only depends on its
+    seed and not on the games played before it in the same process.
+
+    The global `random` and `np.random` states, still used by the
+    sensor of the belief state agent (`_get_evidence`), are seeded
+    from a stream of their own.
+
+    Return:
+    -------
+    - The numpy Generators of the initial ghost positions, of the
+      belief state agent, and the list of those of the `nghosts`
+      ghosts.
+    """
+    layout_rng, sensor_rng, bsagent_rng, *ghost_rngs = \
+        spawnGenerators(seed, nghosts + 3)
+    random.seed(int(sensor_rng.integers(2**63)))
+    np.random.seed(sensor_rng.integers(2**32, size=4))
+    return layout_rng, bsagent_rng, ghost_rngs
+
+
+def set_agent_rng(agent, rng):
+    """
+    Makes `agent` draw from the numpy Generator `rng`, when `rng` is
+    not None and the agent has an `rng` attribute.  Agents thus keep
+    the `__init__(self, args)` signature of the project.
+    """
+    if rng is not None and hasattr(agent, 'rng'):
+        agent.rng = rng
+
+
+def build_parser():
+    """
+    Returns the parser of the command line options of `run.py`,
+    also used to get their default values (see `experiments.py`).
+    """
     usage = """
     USAGE:      python run.py <game_options> <agent_options>
     EXAMPLES:   (1) python run.py
@@ -68,7 +109,15 @@ if __name__ == '__main__':
     parser.add_argument(
         '--ghostagent',
         help='Ghost agent available in the `ghostAgents` module.',
-        choices=["confused", "afraid", "scared"], default="confused")
+        choices=["confused", "afraid", "scared", "fleeing"],
+        default="confused")
+    parser.add_argument(
+        '--ghostweight',
+        help='Weight of the moves that do not bring a fleeing ghost '
+             'closer to pacman, relative to the others '
+             '(confused: 1, afraid: 2, scared: 8).',
+        type=strictly_positive_float,
+        default=1.0)
     parser.add_argument(
         '--layout',
         help='Maze layout (from layout folder).',
@@ -106,12 +155,70 @@ if __name__ == '__main__':
         help='The variance of the sensor estimates.',
         default=1.0,
         type=float)
+    parser.add_argument(
+        '--bsbackend',
+        help='Filtering backend of the belief state agent.',
+        choices=["exact", "particle"], default="exact")
+    parser.add_argument(
+        '--nparticles',
+        help='Number of particles per ghost of the particle backend.',
+        type=strictly_positive_integer, default=1000)
+    parser.add_argument(
+        '--logbelief',
+        help='Run the Bayes filter in the log domain '
+             '(exact backend only).',
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        '--transitioncache',
+        help='Number of transition models kept in the belief state '
+             'agent LRU cache (0 disables the cache).',
+        default=256,
+        type=int)
+    parser.add_argument(
+        '--precomputetransitions',
+        help='Build the transition models of every pacman position '
+             'on the first belief state update.',
+        default=False,
+        action="store_true")
+    parser.add_argument(
+        '--metricsfile',
+        help='File to which the belief state metrics of every step '
+             'are written (see `pacman_module/metrics.py`).',
+        default=None)
+    parser.add_argument(
+        '--metricssteps',
+        help='Stop the game after this number of belief state updates '
+             'have been recorded in the metrics file.',
+        type=strictly_positive_integer,
+        default=None)
+
+    return parser
+
+
+def check_args(args):
+    """
+    Raises a ValueError for combinations of options that would be
+    silently ignored.
+    """
+    if args.logbelief and args.bsbackend == "particle":
+        raise ValueError("--logbelief only applies to the exact "
+                         "--bsbackend, not to the particle backend")
 
+
+if __name__ == '__main__':
+    parser = build_parser()
     args = parser.parse_args()
+    try:
+        check_args(args)
+    except ValueError as e:
+        parser.error(str(e))
 
+    layout_rng, bsagent_rng = None, None
+    ghost_rngs = [None] * max(args.nghosts, 0)
     if args.seed >= 0:
-        np.random.seed(args.seed)
-        random.seed(args.seed)
+        layout_rng, bsagent_rng, ghost_rngs = seed_game(args.seed,
+                                                        args.nghosts)
 
     if (args.agentfile == "humanagent.py" and args.silentdisplay):
         print("Human agent cannot play without graphical display")
@@ -121,7 +228,8 @@ if __name__ == '__main__':
     gagt = ghosts[args.ghostagent]
     nghosts = args.nghosts
     if (nghosts > 0):
-        gagts = [gagt(i + 1, args) for i in range(nghosts)]
+        gagts = [gagt(i + 1, args, rng=ghost_rngs[i])
+                 for i in range(nghosts)]
     else:
         gagts = []
     layout = args.layout
@@ -131,18 +239,22 @@ if __name__ == '__main__':
     if args.bsagentfile is not None:
         bsagt = load_agent_from_file(
             args.bsagentfile, "BeliefStateAgent")(args)
+        set_agent_rng(bsagt, bsagent_rng)
         startingIndex = nghosts+1
     if args.oraclebsagentfile is not None:
         oraclebsagt = load_agent_from_file(
             args.oraclebsagentfile, "BeliefStateAgent")(args)
+    metrics = None
+    if args.metricsfile is not None:
+        metrics = MetricsRecorder(args.metricsfile,
+                                  maxSteps=args.metricssteps)
     total_score, total_computation_time, _ = runGame(
         layout, agent, gagts, bsagt, not args.silentdisplay, expout=0,
         hiddenGhosts=args.hiddenghosts, edibleGhosts=args.edibleghosts,
-        startingIndex=startingIndex, oracleBeliefStateAgent=oraclebsagt)
+        startingIndex=startingIndex, oracleBeliefStateAgent=oraclebsagt,
+        metrics=metrics, rng=layout_rng)
+    if metrics is not None:
+        metrics.close()
 
     print("Total score : " + str(total_score))
     print("Total computation time (seconds) : " + str(total_computation_time))
-    f = open("temp", "w+")
-    s, c = total_score, total_computation_time
-    f.write(str(s) + ";" + str(c))
-    f.close()